@@ -0,0 +1,322 @@
+# coding: utf8
+"""
+*****************************************************
+Non-interactive batch mode of the program. Reads
+expressions line by line from a file or stdin and
+writes one JSON object per line with the derivative,
+an error if any and the timings of each stage, e.g.
+
+python3 batch.py expressions.txt > derivatives.ndjson
+
+A line is either a plain expression or a JSON object
+with the key "expr" and an optional key "id" which is
+passed through to the result. Lines are processed one
+at a time, so memory use does not grow with the input.
+With -j the lines are derived on several processes.
+*****************************************************
+"""
+import os
+import sys
+import json
+import itertools
+import collections
+import time
+import argparse
+import concurrent.futures as futures
+from contextlib import ExitStack
+
+import ui
+import syntax as syn
+import registry
+import tracing
+
+from data import *
+
+
+
+"""
+Gets the context of the batch mode for a directory of the
+persistent cache, without debug printout and with the functions
+of the registry. A process creates one context per directory
+until the registered functions change.
+
+@param cache_dir    string, directory of the persistent cache, 
+                    None for no persistent cache
+
+@return             Context, settings of the derivation
+"""
+def get_batch_context(cache_dir=None):
+    return registry.get_context(debug_level=0, cache_dir=cache_dir)
+
+
+"""
+Reads the expression of a line of the input.
+
+@param line     string, line of the input (plain or JSON)
+
+@return         tuple, (expression, id or None)
+"""
+def read_line(line):
+    line = line.strip()
+    if line.startswith("{"):
+        obj = json.loads(line)
+        return obj["expr"], obj.get("id")
+    return line, None
+
+
+"""
+Computes the derivative of 'expr' like the interactive
+program does but without printing anything.
+
+@param expr     string, expression to be derived
+@param context  Context, settings of the derivation, 
+                None for 'get_batch_context()'
+
+@return         dict, result with the keys "expr", "derivative",
+                "error" and "timings" (seconds per stage)
+"""
+@tracing.traced
+def derive_record(expr, context=None):
+    if context is None:
+        context = get_batch_context()
+    record = {"expr": expr, "derivative": None, "error": None, "timings": {}}
+    timings = record["timings"]
+    try:
+        time_i = time.perf_counter()
+        expr_mod = syn.modify_with_replacements(expr)
+        is_correct = syn.has_correct_syntax(expr_mod)
+        if is_correct:
+            expr_mod = syn.modify_input(expr_mod)
+        timings["syntax"] = time.perf_counter() - time_i
+        if not is_correct:
+            record["error"] = ERROR_SYNTAX + expr
+            return record
+        record["derivative"] = ui.derive_ui(expr_mod, timings, context)
+    except Exception as e:
+        record["error"] = type(e).__name__ + ": " + str(e)
+    return record
+
+
+"""
+Derives the expression of a single line of the input.
+
+@param line     string, line of the input (plain or JSON)
+@param context  Context, settings of the derivation, 
+                None for 'get_batch_context()'
+
+@return         dict, result of 'derive_record(..)',
+                None for an empty line
+"""
+def derive_line(line, context=None):
+    if not line.strip():
+        return None
+    try:
+        expr, expr_id = read_line(line)
+    except (ValueError, KeyError) as e:
+        return {"expr": line.strip(), "derivative": None,
+                "error": type(e).__name__ + ": " + str(e), "timings": {}}
+    record = derive_record(expr, context)
+    if expr_id is not None:
+        record["id"] = expr_id
+    return record
+
+
+"""
+Derives the expressions of 'lines' one after the other.
+Empty lines are skipped.
+
+@param lines        iterable, lines of the input
+@param cache_dir    string, directory of the persistent cache, 
+                    None for no persistent cache
+
+@return             generator, one result dict per expression
+"""
+def derive_batch(lines, cache_dir=None):
+    context = get_batch_context(cache_dir)
+    for line in lines:
+        record = derive_line(line, context)
+        if record is not None:
+            yield record
+
+
+# True once the process has derived the warm-up expression
+IS_WARMED_UP = False
+
+
+"""
+Warms up a worker process before its first chunk. A first
+expression is derived, so that the timings of the first lines
+do not contain loading modules and compiling regular expressions.
+The warm-up expression does not use the persistent cache. This is
+done here instead of in an initializer of the pool, which would
+need Python 3.7.
+"""
+def warm_up_worker():
+    global IS_WARMED_UP
+    if not IS_WARMED_UP:
+        derive_record(BATCH_WARM_UP_EXPR)
+        IS_WARMED_UP = True
+
+
+"""
+Derives a chunk of lines in a worker process.
+
+@param chunk        list, (index, line) pairs of the input
+@param cache_dir    string, directory of the persistent cache, 
+                    None for no persistent cache
+
+@return             list, (index, result dict) pairs, 
+                    without empty lines
+"""
+def derive_chunk(chunk, cache_dir=None):
+    warm_up_worker()
+    context = get_batch_context(cache_dir)
+    records = []
+    for index, line in chunk:
+        record = derive_line(line, context)
+        if record is not None:
+            records.append((index, record))
+    return records
+
+
+"""
+Splits 'lines' into chunks of (index, line) pairs.
+
+@param lines        iterable, lines of the input
+@param chunk_size   int, number of lines per chunk, at least 1
+
+@return             generator, lists of (index, line) pairs
+"""
+def iter_chunks(lines, chunk_size):
+    if chunk_size < 1:
+        raise ValueError("the chunk size must be at least 1: " + str(chunk_size))
+    chunk = []
+    for index, line in enumerate(lines):
+        chunk.append((index, line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+"""
+Derives the expressions of 'lines' in parallel on a pool of
+worker processes. The lines are sent in chunks and only a limited
+number of chunks is in flight, so memory use does not grow
+with the input.
+
+@param lines        iterable, lines of the input
+@param workers      int, number of worker processes, 
+                    None for the number of cores
+@param chunk_size   int, number of lines per chunk
+@param ordered      boolean, if True the results are returned in 
+                    the order of the input, otherwise as they are 
+                    done with the key "index" for the line of the input
+@param cache_dir    string, directory of the persistent cache shared
+                    by the workers, None for no persistent cache
+
+@return             generator, one result dict per expression
+"""
+def derive_parallel(lines, workers=None, chunk_size=BATCH_CHUNK_SIZE, ordered=True, cache_dir=None):
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * BATCH_CHUNKS_PER_WORKER
+    chunks = iter_chunks(lines, chunk_size)
+    with futures.ProcessPoolExecutor(workers) as pool:
+        in_flight = collections.deque()
+        for chunk in itertools.islice(chunks, max_in_flight):
+            in_flight.append(pool.submit(derive_chunk, chunk, cache_dir))
+        while in_flight:
+            if ordered:
+                done = [in_flight.popleft()]
+            else:
+                done, _ = futures.wait(in_flight, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    in_flight.remove(future)
+            # refill before yielding, so the workers stay busy
+            for chunk in itertools.islice(chunks, len(done)):
+                in_flight.append(pool.submit(derive_chunk, chunk, cache_dir))
+            for future in done:
+                for index, record in future.result():
+                    if not ordered:
+                        record["index"] = index
+                    yield record
+
+
+"""
+Writes the results of 'derive_batch(..)' as JSON lines
+to 'out'.
+
+@param lines    iterable, lines of the input
+@param out      file, stream the results are written to
+@param jobs     int, number of worker processes, 1 to derive
+                in this process, None for the number of cores
+@param cache_dir string, directory of the persistent cache, 
+                None for no persistent cache
+@param options  keyword arguments for 'derive_parallel(..)',
+                ignored for a single job
+
+@return         int, number of expressions with an error
+"""
+def run_batch(lines, out, jobs=1, cache_dir=None, **options):
+    if jobs == 1:
+        records = derive_batch(lines, cache_dir)
+    else:
+        records = derive_parallel(lines, jobs, cache_dir=cache_dir, **options)
+    n_errors = 0
+    for record in records:
+        if record["error"] is not None:
+            n_errors += 1
+        out.write(json.dumps(record) + NEWLINE)
+        out.flush()
+    return n_errors
+
+
+"""
+Main method of the batch mode.
+"""
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Derive expressions line by line.")
+    parser.add_argument("input", nargs="?", default="-",
+                        help="file with one expression per line, '-' for stdin")
+    parser.add_argument("-o", "--output", default="-",
+                        help="file for the JSON lines, '-' for stdout")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes, 0 for the number of cores")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE,
+                        help="number of lines sent to a worker at once")
+    parser.add_argument("--unordered", action="store_true",
+                        help="write results as they are done, tagged with their line index")
+    parser.add_argument("--cache-dir", default=None,
+                        help="directory of a persistent cache of derivatives shared by all runs")
+    parser.add_argument("--profile", default=None,
+                        help="file to save the calls and seconds per function as JSON, "
+                             "only for the derivations of this process, i.e. with -j 1")
+    args = parser.parse_args(argv)
+    if args.jobs < 0:
+        parser.error("the number of jobs must not be negative: %d" % args.jobs)
+    if args.chunk_size < 1:
+        parser.error("the chunk size must be at least 1: %d" % args.chunk_size)
+
+    if args.profile is not None:
+        tracing.enable()
+
+    with ExitStack() as stack:
+        if args.input == "-":
+            lines = sys.stdin
+        else:
+            lines = stack.enter_context(open(args.input, encoding="utf8"))
+        if args.output == "-":
+            out = sys.stdout
+        else:
+            out = stack.enter_context(open(args.output, "w", encoding="utf8"))
+        n_errors = run_batch(lines, out, args.jobs or None, args.cache_dir,
+                             chunk_size=args.chunk_size, ordered=not args.unordered)
+    if args.profile is not None:
+        tracing.save_report(args.profile)
+    return 1 if n_errors else 0
+
+
+# main method:
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# coding: utf8
+"""
+*****************************************************
+Benchmarks of the stages of the derivation. Families
+of expressions are generated for growing sizes and
+the seconds of every stage of 'DERIVE_STAGES' are
+measured, e.g.
+
+python3 benchmark.py -o results.json --baseline old.json
+
+prints the scaling of each family, saves the results
+as JSON and compares them with the results of an
+earlier run.
+*****************************************************
+"""
+import sys
+import json
+import platform
+import argparse
+
+import ui
+import context as ctx
+
+from data import *
+
+
+
+"""
+Generates a sum of 'size' different terms, e.g.
+1*x^1+2*sin{x}^2+3*cos{x}^3.
+
+@param size     int, number of terms
+
+@return         string, expression
+"""
+def generate_long_sum(size):
+    bases = [ARG] + [func + "{" + ARG + "}" for func in ELEM_FUNCTIONS]
+    terms = ["%d*%s^%d" % (i, bases[i % len(bases)], i) for i in range(1, size+1)]
+    return "+".join(terms)
+
+
+"""
+Generates a product with 'size' factors that are
+nested into each other, e.g. (x+2)*((x+1)*(x)).
+
+@param size     int, number of factors
+
+@return         string, expression
+"""
+def generate_nested_product(size):
+    expr = ARG
+    for i in range(1, size):
+        expr = "(" + ARG + "+%d)*(" % i + expr + ")"
+    return expr
+
+
+"""
+Generates a chain of 'size' elementary functions,
+e.g. sin{cos{exp{x}}}.
+
+@param size     int, number of functions
+
+@return         string, expression
+"""
+def generate_function_chain(size):
+    expr = ARG
+    for i in range(size):
+        expr = ELEM_FUNCTIONS[i % len(ELEM_FUNCTIONS)] + "{" + expr + "}"
+    return expr
+
+
+"""
+Generates a tower of 'size' powers, e.g. x^(x^(x)).
+
+@param size     int, number of powers
+
+@return         string, expression
+"""
+def generate_power_tower(size):
+    expr = ARG
+    for i in range(1, size):
+        expr = ARG + "^(" + expr + ")"
+    return expr
+
+
+# families of expressions with the method
+# that generates an expression of a given size
+FAMILIES = {
+    "long_sum" : generate_long_sum,
+    "nested_product" : generate_nested_product,
+    "function_chain" : generate_function_chain,
+    "power_tower" : generate_power_tower,
+}
+
+
+"""
+Measures the stages of the derivation of 'expr'. Every
+repetition uses a new context, so no derivative is taken
+from its caches, and the fastest repetition is kept as a
+whole, so the stages add up to its total. Module-level caches
+are shared by all repetitions: the compiled regular expressions
+are only built once, while the interned nodes of 'tree.py' and
+their hashes are weakly referenced and freed with the context.
+
+@param expr     string, expression to be derived
+@param repeats  int, number of repetitions
+
+@return         dict, seconds for each stage and in total
+"""
+def time_stages(expr, repeats):
+    best = None
+    for _ in range(repeats):
+        timings = {}
+        ui.derive_ui(expr, timings, ctx.Context())
+        timings["total"] = sum(timings.values())
+        if best is None or timings.get("total") < best.get("total"):
+            best = timings
+    return best
+
+
+"""
+Runs the benchmarks of 'families' for each size of 'sizes'.
+
+@param families     list, names of the families of 'FAMILIES'
+@param sizes        list, sizes of the generated expressions
+@param repeats      int, number of repetitions of each expression
+
+@return             dict, results with the keys "python", "sizes"
+                    and "families", the seconds of each stage
+                    per family and size
+"""
+def run_benchmarks(families, sizes, repeats=BENCHMARK_REPEATS):
+    results = {"python" : platform.python_version(), "sizes" : list(sizes), "families" : {}}
+    for family in families:
+        generate = FAMILIES.get(family)
+        results["families"][family] = {str(size) : time_stages(generate(size), repeats) for size in sizes}
+    return results
+
+
+"""
+Writes a table of the total seconds per family and size
+to 'out', with the ratio to 'baseline' if it is given.
+
+@param results      dict, results of 'run_benchmarks(..)'
+@param out          file, stream the table is written to
+@param baseline     dict, results of an earlier run or None
+"""
+def print_report(results, out, baseline=None):
+    for family in results.get("families"):
+        out.write(family + NEWLINE)
+        timings_family = results.get("families").get(family)
+        for size in timings_family:
+            timings = timings_family.get(size)
+            line = "  %6s  %12.6f s" % (size, timings.get("total"))
+            line += "".join("  %s=%.6f" % (stage, timings.get(stage)) for stage in timings if stage != "total")
+            if baseline is not None:
+                total_base = baseline.get("families", {}).get(family, {}).get(size, {}).get("total")
+                if total_base:
+                    line += "  x%.2f" % (timings.get("total") / total_base)
+            out.write(line + NEWLINE)
+
+
+"""
+Main method of the benchmarks.
+"""
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the derivation.")
+    parser.add_argument("-f", "--families", nargs="+", default=list(FAMILIES), choices=list(FAMILIES),
+                        help="families of expressions to benchmark")
+    parser.add_argument("-s", "--sizes", nargs="+", type=int, default=BENCHMARK_SIZES,
+                        help="sizes of the generated expressions")
+    parser.add_argument("-r", "--repeats", type=int, default=BENCHMARK_REPEATS,
+                        help="repetitions per expression, the fastest one is kept")
+    parser.add_argument("-o", "--output", default=None,
+                        help="file to save the results as JSON")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON file of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline, encoding="utf8") as f:
+            baseline = json.load(f)
+    results = run_benchmarks(args.families, args.sizes, args.repeats)
+    print_report(results, sys.stdout, baseline)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+# main method:
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# coding: utf8
+"""
+Context of a derivation. A context holds the settings of the
+program, i.e. the argument to derive for, the elementary functions
+with their derivatives and the level for debug printout, together
+with the caches whose entries depend on these settings. The operators
+are those of data.py, the parser and the derivative rules are
+written for them.
+The settings of a context cannot be changed after it has been created
+and its caches are thread-safe, so one context can be used by many
+threads at once. The data of data.py is only read, never modified.
+"""
+import os
+from types import MappingProxyType
+
+import util
+import tree
+import tracing
+import persistent
+
+from data import *
+
+
+
+"""
+Derivative of an elementary function from 'ELEM_FUNCTION_DEVS',
+compiled once when a context is created. The template is parsed
+into a tree in which the symbol 'ARG_PLACEHOLD' stands for the
+argument of the function, e.g. the entries 'log : ARG^(-1)' and
+'exp : exp' become the trees of ARG^(-1) and exp{ARG}. The nodes
+on the paths to the placeholders are located in advance, so that
+substituting the argument only builds these nodes. For derivations
+of strings, the template is split at its placeholders.
+"""
+class DevTemplate(object):
+    __slots__ = ("func", "tree", "slots", "segments")
+
+    """
+    Compiles the template and checks that it is a valid expression
+    in which all symbols are the placeholder or constants. A
+    ValueError is raised for an invalid template.
+
+    @param func         string, elementary function
+    @param template     string, derivative of 'func'
+    """
+    def __init__(self, func, template):
+        if type(template) != str or not template:
+            raise ValueError(ERROR_TEMPLATE % (func, template))
+        segments = None
+        if template.find(ARG_PLACEHOLD) == -1:
+            # the argument follows the template, e.g. for 'exp'
+            template_full = template + "{" + ARG_PLACEHOLD + "}"
+        else:
+            template_full = template
+            segments = tuple(template.split(ARG_PLACEHOLD))
+        try:
+            node = tree.parse(template_full)
+        except ValueError:
+            raise ValueError(ERROR_TEMPLATE % (func, template))
+        slots = []
+        for current in tree.get_nodes_in_order(node):
+            if type(current) == tree.Symbol:
+                if current.name == ARG_PLACEHOLD:
+                    slots.append(current)
+                elif current.name not in EVAL_CONSTANTS:
+                    raise ValueError(ERROR_TEMPLATE % (func, template))
+            elif any(child in slots for child in tree.get_children(current)):
+                slots.append(current)
+        values = {"func" : func, "tree" : node, "slots" : tuple(slots), "segments" : segments}
+        for name in values:
+            object.__setattr__(self, name, values.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("derivative templates cannot be modified")
+
+    """
+    Substitutes the argument 'value' for the placeholder.
+
+    @param value    node, argument of the function
+
+    @return         node, derivative of the function at 'value'
+    """
+    def build_tree(self, value):
+        nodes = {}
+        for slot in self.slots:
+            if type(slot) == tree.Symbol:
+                nodes[slot] = value
+            else:
+                children = [nodes.get(child, child) for child in tree.get_children(slot)]
+                nodes[slot] = tree.replace_children(slot, children)
+        return nodes.get(self.tree)
+
+    """
+    String version of 'build_tree(..)'. Substitutes '(inner)'
+    for the placeholder.
+
+    @param inner    string, argument of the function
+
+    @return         string, derivative of the function at 'inner',
+                    None if the template has no placeholder
+    """
+    def build_string(self, inner):
+        if self.segments is None:
+            return None
+        return ("(" + inner + ")").join(self.segments)
+
+
+"""
+Settings and caches of a derivation. Settings that are not
+given are taken from data.py.
+"""
+class Context(object):
+    __slots__ = ("arg", "functions", "function_ranks", "debug_level", "dev_templates", 
+                 "dev_trees", "value_trees", "implementations", "fold_policy", "derive_cache", 
+                 "simplify_cache", "fingerprint", "disk_cache")
+
+    """
+    @param arg                  string, argument to derive for
+    @param functions            dictionary, elementary functions and their
+                                derivatives like 'ELEM_FUNCTION_DEVS'
+    @param debug_level          int, level for debug printout
+    @param derive_cache_size    int, maximum number of cached derivatives
+    @param simplify_cache_size  int, maximum number of cached simplifications
+    @param cache_dir            string, directory of the persistent cache of
+                                derivatives, None for no persistent cache
+    @param disk_cache_size      int, maximum number of persistently cached derivatives
+    @param values               dictionary, known values of the functions
+                                like 'ELEM_FUNCTION_VALS'
+    @param implementations      dictionary, for each backend of 'evaluate.py' 
+                                a dictionary of functions that evaluate the
+                                elementary functions, those that are not given
+                                are taken from the backend by their names
+    @param fold_policy          string, 'FOLD_EXACT' or 'FOLD_FLOAT', how 
+                                subtrees without symbols are simplified
+    """
+    def __init__(self, arg=ARG, functions=None, debug_level=DEBUG_LEVEL,
+                 derive_cache_size=DERIVE_CACHE_SIZE, simplify_cache_size=SIMPLIFY_CACHE_SIZE,
+                 cache_dir=None, disk_cache_size=DISK_CACHE_SIZE, values=None, implementations=None,
+                 fold_policy=FOLD_POLICY):
+        if functions is None:
+            functions = ELEM_FUNCTION_DEVS
+        if values is None:
+            values = ELEM_FUNCTION_VALS
+        if fold_policy not in (FOLD_EXACT, FOLD_FLOAT):
+            raise ValueError("unknown policy for constant folding: " + repr(fold_policy))
+        functions = dict(functions)
+        values = dict(values)
+        dev_templates = {func : DevTemplate(func, functions.get(func)) for func in functions}
+        disk_cache = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            disk_cache = persistent.PersistentCache(os.path.join(cache_dir, DISK_CACHE_FILE), disk_cache_size)
+        settings = {
+            "arg" : arg,
+            "functions" : MappingProxyType(functions),
+            # order of the functions in simplified products
+            "function_ranks" : MappingProxyType({func : i for i, func in enumerate(functions)}),
+            "debug_level" : debug_level,
+            # templates are compiled and checked once here, not during a derivation
+            "dev_templates" : MappingProxyType(dev_templates),
+            "dev_trees" : MappingProxyType({func : dev_templates.get(func).tree for func in functions}),
+            # function calls with a known value, e.g. sin{0} -> 0
+            "value_trees" : MappingProxyType({tree.parse(call) : tree.parse(values.get(call)) for call in values}),
+            "implementations" : MappingProxyType({backend : MappingProxyType(dict(funcs)) 
+                                                  for backend, funcs in (implementations or {}).items()}),
+            "fold_policy" : fold_policy,
+            "derive_cache" : util.LRUCache(derive_cache_size),
+            "simplify_cache" : util.LRUCache(simplify_cache_size),
+            # settings the derivatives depend on, 
+            # part of the keys of the persistent cache
+            "fingerprint" : "%x" % tree.hash_parts(DISK_CACHE_VERSION, arg, fold_policy,
+                                                  *sorted(functions.items()),
+                                                  *sorted(values.items())),
+            "disk_cache" : disk_cache,
+        }
+        for name in settings:
+            object.__setattr__(self, name, settings.get(name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("the settings of a context cannot be modified")
+
+    """
+    Prints 'string % args' when the debug level of the context
+    is higher than a required level and records it as an event 
+    while tracing is on. The message is only formatted if it is
+    printed or traced, so expression trees in 'args' are not
+    converted to strings otherwise.
+
+    @param string                   string, expression or format string to print
+    @param debug_level_required     int, required level for debug printout
+    @param args                     arguments of the format string
+    """
+    def debug_print(self, string, debug_level_required, *args):
+        tracing.event("debug", string, *args)
+        if self.debug_level >= debug_level_required:
+            print(tracing.format_message(string, args))
+
+    """
+    Gets the key of the persistent cache for the derivative of 'node'. 
+    Expressions that only differ in the order of their summands or 
+    factors share the same key.
+
+    @param node     node, parsed expression to be derived
+
+    @return         string, key of the derivative
+    """
+    def get_disk_key(self, node):
+        return self.fingerprint + ":" + "%x" % tree.structural_hash(node)
+
+
+# context with the settings of data.py, used by all methods
+# that are not given a context, it is never replaced
+DEFAULT_CONTEXT = Context()
+
+
+"""
+Gets 'context' or the default context if it is None.
+
+@param context  Context or None
+
+@return         Context
+"""
+def get_context(context):
+    if context is None:
+        return DEFAULT_CONTEXT
+    return context
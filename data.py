@@ -12,9 +12,9 @@ ARG = "x"
 # to e.g. write log(x) : 1/x as log : ARG^(-1) in 'ELEM_FUNCTION_DEVS'
 ARG_PLACEHOLD = "ARG"
 
-# functions must be ordered in the following way:
-# e.g. sinh must stand after sin,
-# otherwise always 'sin' and not 'sinh' will be found
+# the order of the functions does not matter for finding them,
+# e.g. 'sinh' is found as 'sinh' and not as 'sin',
+# it only defines the order of functions in simplified products
 ELEM_FUNCTION_DEVS = { 
     "exp" : "exp", 
     "log" : ARG_PLACEHOLD+"^(-1)", 
@@ -69,12 +69,79 @@ REPLACEMENTS = {
 # are allowed and will be transformed
 OPERATOR_COMBINATIONS = ["*+", "*-", "^+", "^-"]
 
+# number of expressions whose bracket index is cached, the
+# derivation works on an expression and its parts at a time,
+# so few indexes are enough and long expressions use little memory
+BRACKET_INDEX_CACHE_SIZE = 16
+
+# maximum number of derivatives of subexpressions
+# that are kept in the cache of derive.py
+DERIVE_CACHE_SIZE = 4096
+
+# maximum number of simplified subtrees
+# that are kept in the cache of simplify.py
+SIMPLIFY_CACHE_SIZE = 4096
+
+# name of the file of the persistent cache in its directory, 
+# maximum number of its entries, number of new entries after which 
+# the size is checked and seconds to wait for a locked database
+DISK_CACHE_FILE = "derivatives.sqlite"
+DISK_CACHE_SIZE = 1000000
+DISK_CACHE_EVICT_INTERVAL = 256
+DISK_CACHE_TIMEOUT = 30
+
+# version of the rules for derivation and simplification,
+# part of the keys of the persistent cache, it must be increased
+# whenever these rules change, so that old entries are not used
+DISK_CACHE_VERSION = 1
+
+# policies for constant subtrees: 'FOLD_EXACT' only inserts the known
+# values of 'ELEM_FUNCTION_VALS' and computes exact results of numbers,
+# 'FOLD_FLOAT' also evaluates function calls, powers and constants 
+# like 'e' to floats, e.g. sin{2} -> 0.9092974268256817
+FOLD_EXACT = "exact"
+FOLD_FLOAT = "float"
+FOLD_POLICY = FOLD_EXACT
+
+# maximum number of compiled expressions that are cached
+COMPILE_CACHE_SIZE = 1024
+
+# symbols with a value when an expression is evaluated
+EVAL_CONSTANTS = {
+    "e" : 2.718281828459045, 
+    "pi" : 3.141592653589793
+}
+
+# sizes of the generated expressions of the benchmarks
+# and number of repetitions of each expression
+BENCHMARK_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+BENCHMARK_REPEATS = 3
+
+# maximum number of events that are kept while tracing is on
+TRACE_MAX_EVENTS = 10000
+
+# maximum length of an argument of a traced event, longer
+# arguments like whole expressions are cut off
+TRACE_MAX_ARG_LENGTH = 1000
+
+# number of input lines that are sent to a worker process
+# at once in the parallel batch mode and number of chunks
+# per worker that are in flight at the same time
+BATCH_CHUNK_SIZE = 64
+BATCH_CHUNKS_PER_WORKER = 4
+
+# expression derived by each worker process at its start,
+# so that modules, regular expressions and templates are loaded
+BATCH_WARM_UP_EXPR = "sin(x)*exp(x^2)+log(x)/x"
+
 # strings for printout
 LINE_STARS = "**********************************************************************"
 ERROR_SYNTAX = "ERROR: Invalid syntax in expression: "
+ERROR_TEMPLATE = "ERROR: Invalid derivative of '%s' in the function table: %r"
 NEWLINE = "\n"
 
 # level for debug printout, 
 # the higher, the more information, 
-# 0 no printout at all
-DEBUG_LEVEL = 1
+# 0 no printout at all, at 1 the
+# program prints the stages of each derivation
+DEBUG_LEVEL = 0
@@ -3,28 +3,30 @@
 Methods to derive an expression.
 """
 import util
+import tree
+import context as ctx
 import brackets as br
+import tracing
 
 from data import *
+from tree import Number, Symbol, Unary, Binary, Call
 
 
 
 """
-Checks if 'expr' contains the argument 'ARG'.
+Checks if 'expr' contains the argument 'arg' as a whole name,
+so names of functions or other variables that contain 'arg'
+are not counted, e.g. 'exp' or 'x1' for 'x'.
 
 @param expr     string, expression to be checked
+@param arg      string, argument to look for, None for 'ARG'
 
-@return:        boolean, True if 'expr' contains 'ARG', False otherwise
+@return:        boolean, True if 'expr' contains 'arg', False otherwise
 """
-def is_arg_in_expr(expr):
-    for i, ch in enumerate(expr):
-        elem_func = util.get_elem_func(expr, i)
-        if elem_func != "":
-            i += len(elem_func)
-            continue
-        if ch == ARG:
-            return True
-    return False
+def is_arg_in_expr(expr, arg=None):
+    if arg is None:
+        arg = ARG
+    return util.compile_arg_regex(arg).search(expr) is not None
 
 
 """
@@ -89,44 +91,79 @@ def power_law_dev(base, exponent):
     return dev
 
 
+"""
+Changes the maximum number of derivatives in the cache of
+the default context, which holds the derivatives of
+subexpressions and of subtrees for each argument.
+
+@param maxsize  int, maximum number of cached derivatives, 
+                0 disables the cache
+"""
+def set_derive_cache_size(maxsize):
+    ctx.get_context(None).derive_cache.resize(maxsize)
+
+
 """
 Derives 'expr' by using the sum rule, the product rule and the chain rule.
 If it is not possible to derive any subexpression "devOf('subexpression')"
-is written to the output string.
+is written to the output string. Derivatives of subexpressions are taken
+from the cache of the context if they have been computed before.
 
 @param expr     string, expression to be derived
+@param context  Context, settings with the elementary functions 
+                and the cache, None for the default
 
 @return         string, derived expression
 """
-def derive_sub(expr):
-    util.debug_print("Derive:\t"+expr, 10)
+def derive_sub(expr, context=None):
+    util.debug_print("Derive:\t%s", 10, expr)
     # unnecessary brackets should be removed at each run
     expr = br.remove_brackets(expr)
+    key = (expr, ARG)
+    cache = ctx.get_context(context).derive_cache
+    derivative = cache.get(key)
+    if derivative is None:
+        derivative = derive_expr(expr, context)
+        cache.put(key, derivative)
+    return derivative
+
+
+"""
+Submethod of 'derive_sub(..)' that derives 'expr' without
+looking into the cache.
+
+@param expr     string, expression to be derived, 
+                without unnecessary brackets
+@param context  Context, settings with the elementary functions, 
+                None for the default
+
+@return         string, derived expression
+"""
+def derive_expr(expr, context=None):
     if not is_arg_in_expr(expr):
         return "0"
     elif expr == ARG:
         return "1"
     derivative = ""
-    # if expr starts with a sign, add a '0' to its start
-    if expr[0] == '+' or expr[0] == '-':
-        expr = '0' + expr
     
     opPos = util.get_pos_of_first_lowest_precedence_op(expr)
     if opPos > -1:
         op = expr[opPos]
         [subexpr1, subexpr2] = split_left_right(expr, opPos)
+        # if expr starts with a sign, its left part is '0'
+        subexpr1 = subexpr1 or "0"
         if op == "+":
-            derivative += derive_sub(subexpr1) + "+" + derive_sub(subexpr2)
+            derivative += derive_sub(subexpr1, context) + "+" + derive_sub(subexpr2, context)
             return derivative
         if op == "-":
             # '-' sign in the in front of 'subexpr2' has been removed before, 
             # must be added again before applying 'swap_plus_and_minus_signs(..)'
-            derivative += derive_sub(subexpr1) + "-(" + derive_sub(swap_plus_and_minus_signs("-"+subexpr2)) + ")"
+            derivative += derive_sub(subexpr1, context) + "-(" + derive_sub(br.swap_plus_and_minus_signs("-"+subexpr2), context) + ")"
             return derivative
         if op == "*":
-            derivative += "(" + derive_sub(subexpr1) +")*(" + subexpr2 + ")"
+            derivative += "(" + derive_sub(subexpr1, context) +")*(" + subexpr2 + ")"
             derivative += "+"
-            derivative += "(" + subexpr1 +")*(" + derive_sub(subexpr2) + ")"
+            derivative += "(" + subexpr1 +")*(" + derive_sub(subexpr2, context) + ")"
             return derivative
         if op == "^":
             if not is_arg_in_expr(subexpr1) and not is_arg_in_expr(subexpr2):
@@ -136,43 +173,371 @@ def derive_sub(expr):
                 # convert to exp law and call derive again
                 # a(x)^b(x) = exp(ln(a(x))*b(x))
                 expr = "exp{log{" + subexpr1 + "}*" + subexpr2 + "}"
-                derivative = derive_sub(expr)
+                derivative = derive_sub(expr, context)
                 return derivative
             else:
                 # a(x)^n
                 if subexpr1 == ARG:
                     derivative = power_law_dev(subexpr1, subexpr2)
                 else:
-                    derivative = power_law_dev(subexpr1, subexpr2) + "*(" + derive_sub(br.remove_brackets(subexpr1))+ ")"
+                    derivative = power_law_dev(subexpr1, subexpr2) + "*(" + derive_sub(br.remove_brackets(subexpr1), context)+ ")"
                 return derivative
     # then scan 'expr' for chain rule
-    for i, _ in enumerate(expr):
-        func = util.get_elem_func(expr, i)
-        util.debug_print(func, 10)
-        if func != "":
-            idx_i = i+len(func)
-            idx_f = util.get_closed_bracket_pos(expr, idx_i)
-            # apply chain rule
-            outer = ELEM_FUNCTION_DEVS.get(func)
-            inner = expr[idx_i+1 : idx_f]
-            # reminder 'ARG_PLACEHOLD' is a placeholder in the derivative dictionary
-            # to e.g. write the entry log(x) : 1/x as log : ARG^(-1)
-            posArg = outer.find(ARG_PLACEHOLD)
-            if posArg > -1:
-                while posArg > -1:
-                    # replace all 'ARG_PLACEHOLD's from outer with '(inner)'
-                    # add '(derive_sub(inner))' to string
-                    outer = outer[:posArg] + "(" + inner + ")" + outer[posArg+len(ARG_PLACEHOLD):len(outer)]
-                    posArg = outer.find(ARG_PLACEHOLD)
-                derivative += "(" + outer + ")" + "*" + "(" + derive_sub(inner) + ")"
-                return derivative
-            # outer derivative * inner derivative
-            if inner == ARG:
-                derivative += outer + "{" +ARG + "}"
-            else:
-                derivative += outer + "{" + inner+ "}" + "*" + "(" + derive_sub(inner) + ")"
+    context = ctx.get_context(context)
+    for i, func in util.scan_elem_funcs(expr, context.functions):
+        util.debug_print("%s", 10, func)
+        idx_i = i+len(func)
+        idx_f = util.get_closed_bracket_pos(expr, idx_i)
+        # apply chain rule
+        template = context.dev_templates.get(func)
+        outer = context.functions.get(func)
+        inner = expr[idx_i+1 : idx_f]
+        # reminder 'ARG_PLACEHOLD' is a placeholder in the derivative dictionary
+        # to e.g. write the entry log(x) : 1/x as log : ARG^(-1),
+        # the template has been split at the placeholders before
+        outer_inner = template.build_string(inner)
+        if outer_inner is not None:
+            derivative += "(" + outer_inner + ")" + "*" + "(" + derive_sub(inner, context) + ")"
             return derivative
+        # outer derivative * inner derivative
+        if inner == ARG:
+            derivative += outer + "{" +ARG + "}"
+        else:
+            derivative += outer + "{" + inner+ "}" + "*" + "(" + derive_sub(inner, context) + ")"
+        return derivative
     # then for everything else
     derivative += "d{" + expr + ", " + ARG + "}"
     return derivative
 
+
+"""
+Gets the compiled derivative of the elementary function 'func',
+whose method 'build_tree(..)' substitutes the argument of 'func'.
+E.g. the entries 'log : ARG^(-1)' and 'exp : exp' become
+the templates of ARG^(-1) and exp{ARG}.
+
+@param func     string, elementary function of the context
+@param context  Context, settings of the derivation, None for the default
+
+@return         DevTemplate, derivative of 'func', None if 'func'
+                is no elementary function of the context
+"""
+def get_dev_template(func, context=None):
+    return ctx.get_context(context).dev_templates.get(func)
+
+
+"""
+Multiplies 'left' with 'right', a factor 1 is left out.
+
+@param left     node, left factor
+@param right    node, right factor
+
+@return         node, product of both factors
+"""
+def multiply_tree(left, right):
+    if tree.is_number(right, 1):
+        return left
+    if tree.is_number(left, 1):
+        return right
+    return Binary("*", left, right)
+
+
+"""
+Tree version of 'power_law_dev(..)'. Derives base^exponent
+where 'exponent' does not depend on the argument to derive for.
+
+@param base         node, base of the power law
+@param exponent     node, exponent of the power law
+
+@return             node, derivative of the power law without the 
+                    inner derivative of 'base', None if it is 0
+"""
+def power_law_tree(base, exponent):
+    if type(exponent) == Number:
+        if exponent.value == 0:
+            return None
+        if exponent.value == 1:
+            return Number(1)
+        exponent_new = Number(exponent.value-1)
+    else:
+        exponent_new = Binary("-", exponent, Number(1))
+    return Binary("*", exponent, Binary("^", base, exponent_new))
+
+
+"""
+Checks if the function call 'node' can be derived by the chain rule,
+i.e. if it calls an elementary function of the context with one argument.
+
+@param node     node, function call
+@param context  Context, settings of the derivation, None for the default
+
+@return         boolean, True if 'node' can be derived by the chain rule
+"""
+def is_derivable_call(node, context=None):
+    return get_dev_template(node.func, context) is not None and len(node.args) == 1
+
+
+"""
+Derives the function call 'node' by using the chain rule.
+Functions that are not elementary functions of the context
+are written as d{node, arg}.
+
+@param node         node, function call to be derived
+@param arg          string, argument to derive for
+@param devs_inner   node list, derivatives of the arguments of 'node',
+                    None for derivatives that are 0
+@param context      Context, settings of the derivation, None for the default
+
+@return             node, derived function call, None if it is 0
+"""
+def derive_call_tree(node, arg, devs_inner, context=None):
+    if all(dev is None for dev in devs_inner):
+        return None
+    if not is_derivable_call(node, context):
+        return Call("d", (node, Symbol(arg)))
+    return multiply_tree(get_dev_template(node.func, context).build_tree(node.args[0]), devs_inner[0])
+
+
+"""
+Submethod of 'derive_tree(..)'. Returns None instead of
+a tree for a derivative that is 0, so that parts that do not
+depend on 'arg' can be dropped while building the derivative.
+The tree is traversed with an explicit stack, every subtree is
+derived once after its children. Derivatives of subtrees are 
+taken from the cache of the context if they have been computed before.
+
+@param node             node, expression tree to be derived
+@param arg              string, argument to derive for
+@param context          Context, settings of the derivation, None for the default
+@param dependencies     dictionary, variables each subtree depends on 
+                        from 'get_dependencies(..)', subtrees without 
+                        'arg' are not visited, None to visit all subtrees
+
+@return                 node, derived expression tree, None if it is 0
+"""
+def derive_tree_sub(node, arg, context=None, dependencies=None):
+    cache = ctx.get_context(context).derive_cache
+    # derivatives of the subtrees that are done
+    devs = {}
+    # subtrees whose children are on the stack
+    expanded = set()
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in devs:
+            stack.pop()
+            continue
+        if type(current) == Number:
+            devs[current] = None
+            continue
+        if type(current) == Symbol:
+            devs[current] = Number(1) if current.name == arg else None
+            continue
+        if dependencies is not None and arg not in dependencies.get(current):
+            devs[current] = None
+            continue
+        key = (current, arg)
+        if current not in expanded:
+            dev = cache.get(key, util.CACHE_MISS)
+            if dev is not util.CACHE_MISS:
+                devs[current] = dev
+                continue
+            expanded.add(current)
+            stack.extend(child for child in tree.get_children(current) if child not in devs)
+            continue
+        stack.pop()
+        devs_children = [devs.get(child) for child in tree.get_children(current)]
+        dev = derive_node_tree(current, arg, devs_children, context)
+        devs[current] = dev
+        cache.put(key, dev)
+    return devs.get(node)
+
+
+"""
+Derives 'node' from the derivatives of its children.
+
+@param node             node, expression tree to be derived,
+                        neither a number nor a symbol
+@param arg              string, argument to derive for
+@param devs_children    node list, derivatives of the children of 'node',
+                        None for derivatives that are 0
+@param context          Context, settings of the derivation, None for the default
+
+@return                 node, derived expression tree, None if it is 0
+"""
+def derive_node_tree(node, arg, devs_children, context=None):
+    if type(node) == Call:
+        return derive_call_tree(node, arg, devs_children, context)
+    if type(node) == Unary:
+        if devs_children[0] is None:
+            return None
+        return Unary(node.op, devs_children[0])
+    dev_left, dev_right = devs_children
+    if dev_left is None and dev_right is None:
+        return None
+    if node.op == "+" or node.op == "-":
+        if dev_right is None:
+            return dev_left
+        if dev_left is None:
+            return dev_right if node.op == "+" else Unary("-", dev_right)
+        return Binary(node.op, dev_left, dev_right)
+    if node.op == "*":
+        if dev_right is None:
+            return multiply_tree(dev_left, node.right)
+        if dev_left is None:
+            return multiply_tree(node.left, dev_right)
+        return Binary("+", multiply_tree(dev_left, node.right), multiply_tree(node.left, dev_right))
+    # op == "^"
+    if dev_right is None:
+        # a(x)^n
+        dev = power_law_tree(node.left, node.right)
+        if dev is None:
+            return None
+        return multiply_tree(dev, dev_left)
+    # a(x)^b(x) = exp(log(a(x))*b(x)), whose derivative
+    # is a(x)^b(x)*(log(a(x))*b'(x)+b(x)*a(x)^(-1)*a'(x))
+    dev = multiply_tree(Call("log", (node.left,)), dev_right)
+    if dev_left is not None:
+        dev = Binary("+", dev, multiply_tree(Binary("*", node.right, Binary("^", node.left, Number(-1))), dev_left))
+    return Binary("*", node, dev)
+
+
+"""
+Tree version of 'derive_sub(..)'. Derives 'node' by using 
+the sum rule, the product rule and the chain rule without
+converting any part of the expression tree back to a string.
+
+@param node     node, expression tree to be derived
+@param arg      string, argument to derive for, 
+                None for the argument of the context
+@param context  Context, settings of the derivation, None for the default
+
+@return         node, derived expression tree
+"""
+@tracing.traced
+def derive_tree(node, arg=None, context=None):
+    if arg is None:
+        arg = ctx.get_context(context).arg
+    dev = derive_tree_sub(node, arg, context)
+    if dev is None:
+        return Number(0)
+    return dev
+
+
+"""
+Gets the variables of 'args' that each subtree of 'node' 
+depends on. Every subtree is visited once, after its children.
+
+@param node     node, expression tree
+@param args     iterable, names of the variables
+
+@return         dictionary, frozenset of variables for each subtree
+"""
+def get_dependencies(node, args):
+    args = frozenset(args)
+    dependencies = {}
+    for current in tree.get_nodes_in_order(node):
+        if type(current) == Symbol:
+            dependencies[current] = args & {current.name}
+        else:
+            children = tree.get_children(current)
+            dependencies[current] = frozenset().union(*(dependencies.get(child) for child in children))
+    return dependencies
+
+
+"""
+Derives 'node' for each variable of 'args', i.e. gets its gradient.
+The variables each subtree depends on are found once for all
+variables and a partial derivative only visits the subtrees that
+depend on its variable. Derivatives of subtrees are shared
+through the cache of the context.
+
+@param node     node, expression tree to be derived
+@param args     iterable, names of the variables to derive for
+@param context  Context, settings of the derivation, None for the default
+@param reverse  boolean, True to derive in reverse mode 
+                with 'derive_adjoint(..)'
+
+@return         dictionary, derived expression tree for each variable
+"""
+@tracing.traced
+def derive_gradient(node, args, context=None, reverse=False):
+    if reverse:
+        return derive_adjoint(node, args, context)
+    dependencies = get_dependencies(node, args)
+    gradient = {}
+    for arg in args:
+        dev = derive_tree_sub(node, arg, context, dependencies)
+        gradient[arg] = Number(0) if dev is None else dev
+    return gradient
+
+
+"""
+Gets the contributions of 'node' to the adjoints of its children, 
+i.e. 'adjoint' times the partial derivative of 'node' for each child.
+
+@param node             node, expression tree that is no number, no symbol
+                        and no call that 'is_derivable_call(..)' rejects
+@param adjoint          node, adjoint of 'node'
+@param dependencies     dictionary, variables each subtree depends on
+@param context          Context, settings of the derivation, None for the default
+
+@return                 node list, contribution for each child, 
+                        None for contributions that are 0
+"""
+def get_adjoint_contributions(node, adjoint, dependencies, context=None):
+    if type(node) == Call:
+        return [multiply_tree(adjoint, get_dev_template(node.func, context).build_tree(node.args[0]))]
+    if type(node) == Unary:
+        return [Unary("-", adjoint) if node.op == "-" else adjoint]
+    if node.op == "+":
+        return [adjoint, adjoint]
+    if node.op == "-":
+        return [adjoint, Unary("-", adjoint)]
+    if node.op == "*":
+        return [multiply_tree(adjoint, node.right), multiply_tree(adjoint, node.left)]
+    # op == "^", the logarithm of the base is only 
+    # needed if the exponent depends on a variable
+    dev_left = power_law_tree(node.left, node.right)
+    dev_right = None
+    if dependencies.get(node.right):
+        dev_right = multiply_tree(adjoint, Binary("*", node, Call("log", (node.left,))))
+    return [None if dev_left is None else multiply_tree(adjoint, dev_left), dev_right]
+
+
+"""
+Derives 'node' for each variable of 'args' in reverse mode. The 
+adjoint of a subtree is the derivative of 'node' for this subtree. 
+The adjoints are passed from the root to the leaves in one sweep,
+every subtree after all subtrees that contain it, so the cost does 
+not grow with the number of variables. The partial derivative for
+a variable is the adjoint of its symbol.
+
+@param node     node, expression tree to be derived
+@param args     iterable, names of the variables to derive for
+@param context  Context, settings of the derivation, None for the default
+
+@return         dictionary, derived expression tree for each variable
+"""
+@tracing.traced
+def derive_adjoint(node, args, context=None):
+    dependencies = get_dependencies(node, args)
+    adjoints = {node : Number(1)}
+    for current in reversed(tree.get_nodes_in_order(node)):
+        adjoint = adjoints.get(current)
+        if adjoint is None or type(current) == Number or type(current) == Symbol:
+            continue
+        if type(current) == Call and not is_derivable_call(current, context):
+            # written as d{current, arg} for each variable like in forward 
+            # mode, so the adjoint is passed to the symbols directly
+            children = [Symbol(arg) for arg in dependencies.get(current)]
+            contributions = [multiply_tree(adjoint, Call("d", (current, child))) for child in children]
+        else:
+            children = tree.get_children(current)
+            contributions = get_adjoint_contributions(current, adjoint, dependencies, context)
+        for child, contribution in zip(children, contributions):
+            if contribution is None or not dependencies.get(child):
+                continue
+            adjoint_child = adjoints.get(child)
+            adjoints[child] = contribution if adjoint_child is None else Binary("+", adjoint_child, contribution)
+    return {arg : adjoints.get(Symbol(arg), Number(0)) for arg in args}
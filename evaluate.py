@@ -0,0 +1,384 @@
+# coding: utf8
+"""
+Compiles expressions, e.g. the derivatives returned by
+'derive_ui(..)', into Python functions that evaluate them,
+and computes values of derivatives with forward-mode and
+reverse-mode automatic differentiation. With NumPy the
+functions work on scalars and on arrays, where every
+elementary function is the NumPy ufunc, without NumPy
+they work on scalars with the math module.
+"""
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import util
+import tree
+import derive as dev
+import context as ctx
+import tracing
+
+from data import *
+
+
+
+# compiled functions, keyed by the expression tree, the names of
+# the arguments, the elementary functions, their implementations
+# and the backend
+COMPILE_CACHE = util.LRUCache(COMPILE_CACHE_SIZE)
+
+
+"""
+Gets the module whose functions are used to evaluate
+an expression.
+
+@param backend  string, "numpy", "math" or None for
+                NumPy if it is installed, otherwise math
+
+@return         module, NumPy or math
+"""
+def get_backend(backend=None):
+    if backend is None:
+        backend = "math" if numpy is None else "numpy"
+    if backend == "numpy":
+        if numpy is None:
+            raise ImportError("the backend 'numpy' needs NumPy to be installed")
+        return numpy
+    if backend == "math":
+        return math
+    raise ValueError("unknown backend: " + str(backend))
+
+
+"""
+Gets the function that evaluates the elementary function 'func',
+the one registered in the context for the backend or otherwise
+the function of the backend with the same name.
+
+@param func     string, name of the elementary function
+@param module   module, NumPy or math
+@param context  Context, settings with the elementary functions
+
+@return         function, None if 'func' cannot be evaluated
+"""
+def get_implementation(func, module, context):
+    if func not in context.functions:
+        return None
+    implementation = context.implementations.get(module.__name__, {}).get(func)
+    if implementation is None:
+        implementation = getattr(module, func, None)
+    return implementation
+
+
+"""
+Gets the function that raises a base to a power. Unlike '**' 
+it gives no complex numbers for negative bases and fractional
+exponents, with math a ValueError is raised like for 'math.sqrt' 
+and with NumPy the result is nan like for 'numpy.sqrt'.
+
+@param module   module, NumPy or math
+
+@return         function, takes the base and the exponent
+"""
+def get_power(module):
+    if module is math:
+        return math.pow
+    return module.power
+
+
+"""
+Gets the value of the number node 'node' as a float,
+floats avoid integer arrays raised to negative powers.
+
+@param node     node, number node
+
+@return         float, value of 'node'
+"""
+def get_number_value(node):
+    try:
+        return float(node.value)
+    except OverflowError:
+        raise ValueError("cannot evaluate the number '" + str(node.value) + "', it is too large for a float")
+
+
+"""
+Generates the source of a Python function evaluating 'node'.
+Each distinct node is computed once and stored in a local
+variable, so common subexpressions are not evaluated twice
+and the source has no nesting, however deep the tree is.
+
+@param node     node, expression tree
+@param args     tuple, names of the arguments of the function
+
+@return         tuple, (source, names of the functions and
+                constants that have to be defined for the source)
+"""
+def generate_source(node, args):
+    names = {}
+    used = set()
+    lines = ["def compiled(" + ", ".join("a%d" % i for i in range(len(args))) + "):"]
+    for i, current in enumerate(tree.get_nodes_in_order(node)):
+        name = "t%d" % i
+        if type(current) == tree.Number:
+            value = repr(get_number_value(current))
+        elif type(current) == tree.Symbol:
+            if current.name in args:
+                value = "a%d" % args.index(current.name)
+            else:
+                value = "c_" + current.name
+                used.add(current.name)
+        elif type(current) == tree.Call:
+            value = "f_" + current.func + "(" + ", ".join(names.get(arg) for arg in current.args) + ")"
+            used.add(current.func)
+        elif type(current) == tree.Unary:
+            value = current.op + names.get(current.operand)
+        elif current.op == "^":
+            value = "op_pow(" + names.get(current.left) + ", " + names.get(current.right) + ")"
+        else:
+            value = names.get(current.left) + " " + current.op + " " + names.get(current.right)
+        names[current] = name
+        lines.append("    " + name + " = " + value)
+    lines.append("    return " + names.get(node))
+    return NEWLINE.join(lines) + NEWLINE, used
+
+
+"""
+Compiles 'expr' into a Python function which takes the
+values of the arguments 'args' in that order and returns
+the value of the expression. Compiled functions are cached.
+
+@param expr     string or node, expression with round or curly
+                brackets, e.g. the result of 'derive_ui(..)'
+@param args     tuple, names of the arguments, None for
+                the argument of the context
+@param context  Context, settings with the argument and the
+                elementary functions, None for the default
+@param backend  string, "numpy", "math" or None for the default
+
+@return         function, evaluates the expression for scalars
+                and, with NumPy, for arrays of any shape
+"""
+@tracing.traced
+def compile_expr(expr, args=None, context=None, backend=None):
+    context = ctx.get_context(context)
+    module = get_backend(backend)
+    node = tree.parse(expr) if type(expr) == str else expr
+    args = (context.arg,) if args is None else tuple(args)
+    implementations = context.implementations.get(module.__name__, {})
+    key = (node, args, frozenset(context.functions), frozenset(implementations.items()), module.__name__)
+    compiled = COMPILE_CACHE.get(key)
+    if compiled is not None:
+        return compiled
+
+    source, used = generate_source(node, args)
+    namespace = {"op_pow" : get_power(module)}
+    for name in used:
+        implementation = get_implementation(name, module, context)
+        if implementation is not None:
+            namespace["f_" + name] = implementation
+        elif name in EVAL_CONSTANTS:
+            namespace["c_" + name] = EVAL_CONSTANTS.get(name)
+        else:
+            raise ValueError("cannot evaluate '" + name + "', it is no argument, constant or elementary function")
+    exec(compile(source, "<compiled " + tree.to_string(node) + ">", "exec"), namespace)
+    compiled = namespace.get("compiled")
+    COMPILE_CACHE.put(key, compiled)
+    return compiled
+
+
+"""
+Applies the derivative rule of operator 'op' to the dual
+numbers 'left' and 'right'. A dual number is a pair of a value
+and a derivative, the derivative is None for parts of the 
+expression that do not depend on the argument.
+
+@param op       char, operator of a binary node
+@param left     tuple, dual number of the left operand
+@param right    tuple, dual number of the right operand
+@param module   module, NumPy or math
+
+@return         tuple, dual number of the result
+"""
+def apply_dual_operator(op, left, right, module):
+    u, du = left
+    v, dv = right
+    if op == "+" or op == "-":
+        value = u + v if op == "+" else u - v
+        if dv is None:
+            return value, du
+        if op == "-":
+            dv = -dv
+        return value, dv if du is None else du + dv
+    if op == "*":
+        value = u * v
+        if du is None:
+            return value, None if dv is None else u * dv
+        return value, du * v if dv is None else du * v + u * dv
+    power = get_power(module)
+    value = power(u, v)
+    if dv is None:
+        # power rule, no logarithm of a possibly negative base
+        return value, None if du is None else v * power(u, v - 1) * du
+    dot = dv * module.log(u)
+    if du is not None:
+        dot = dot + v * du / u
+    return value, value * dot
+
+
+"""
+Computes the value and the derivative of 'expr' for the values 'x'
+of the argument with forward-mode automatic differentiation. 
+The tree is walked once with dual numbers and the derivatives of the
+elementary functions are those of the context, so no derivative 
+expression is built. With NumPy 'x' may be an array and all
+points are computed in one walk.
+
+@param expr         string or node, expression with round or curly brackets
+                    in the form of the input of 'derive_ui(..)'
+@param x            float or array, values of the argument
+@param arg          string, argument to derive for, None for 
+                    the argument of the context
+@param constants    dictionary, values of further symbols,
+                    added to 'EVAL_CONSTANTS'
+@param context      Context, settings with the elementary functions
+                    and their derivatives, None for the default
+@param backend      string, "numpy", "math" or None for the default
+
+@return             tuple, (value, derivative) of the expression at 'x'
+"""
+@tracing.traced
+def derive_forward(expr, x, arg=None, constants=None, context=None, backend=None):
+    context = ctx.get_context(context)
+    module = get_backend(backend)
+    node = tree.parse(expr) if type(expr) == str else expr
+    if arg is None:
+        arg = context.arg
+    constants = dict(EVAL_CONSTANTS, **(constants or {}))
+    duals = {}
+    for current in tree.get_nodes_in_order(node):
+        if type(current) == tree.Number:
+            dual = (get_number_value(current), None)
+        elif type(current) == tree.Symbol:
+            if current.name == arg:
+                dual = (x, 1.0)
+            elif current.name in constants:
+                dual = (constants.get(current.name), None)
+            else:
+                raise ValueError("cannot evaluate '" + current.name + "', it is no argument or constant")
+        elif type(current) == tree.Call:
+            implementation = get_implementation(current.func, module, context)
+            if implementation is None:
+                raise ValueError("cannot evaluate '" + current.func + "', it is no elementary function")
+            u, du = duals.get(current.args[0])
+            dot = None
+            if du is not None:
+                # chain rule with the compiled derivative template
+                outer = compile_expr(context.dev_trees.get(current.func), (ARG_PLACEHOLD,), context, backend)
+                dot = outer(u) * du
+            dual = (implementation(u), dot)
+        elif type(current) == tree.Unary:
+            u, du = duals.get(current.operand)
+            if current.op == "-":
+                u, du = -u, None if du is None else -du
+            dual = (u, du)
+        else:
+            dual = apply_dual_operator(current.op, duals.get(current.left), duals.get(current.right), module)
+        duals[current] = dual
+    value, dot = duals.get(node)
+    # derivatives in the shape of 'x', also those of constant
+    # expressions and of expressions like 5*x
+    zeros = x * 0.0
+    dot = zeros if dot is None else dot + zeros
+    return value, dot
+
+
+"""
+Computes the value and the gradient of 'expr' with reverse-mode
+automatic differentiation. The values of all subtrees are computed
+in one walk and the adjoints, i.e. the derivatives of the expression 
+for each subtree, are passed back to the symbols in a second walk,
+so the cost is a small multiple of one evaluation, no matter how many
+variables there are. With NumPy the values may be arrays.
+
+@param expr     string or node, expression with round or curly brackets
+                in the form of the input of 'derive_ui(..)'
+@param values   dictionary, values of the variables to derive for
+@param context  Context, settings with the elementary functions
+                and their derivatives, None for the default
+@param backend  string, "numpy", "math" or None for the default
+
+@return         tuple, (value of the expression, dictionary
+                with the partial derivative for each variable)
+"""
+@tracing.traced
+def gradient_reverse(expr, values, context=None, backend=None):
+    context = ctx.get_context(context)
+    module = get_backend(backend)
+    node = tree.parse(expr) if type(expr) == str else expr
+    nodes = tree.get_nodes_in_order(node)
+    dependencies = dev.get_dependencies(node, values)
+
+    results = {}
+    for current in nodes:
+        if type(current) == tree.Number:
+            result = get_number_value(current)
+        elif type(current) == tree.Symbol:
+            if current.name in values:
+                result = values.get(current.name)
+            elif current.name in EVAL_CONSTANTS:
+                result = EVAL_CONSTANTS.get(current.name)
+            else:
+                raise ValueError("cannot evaluate '" + current.name + "', it is no variable or constant")
+        elif type(current) == tree.Call:
+            implementation = get_implementation(current.func, module, context)
+            if implementation is None:
+                raise ValueError("cannot evaluate '" + current.func + "', it is no elementary function")
+            result = implementation(results.get(current.args[0]))
+        elif type(current) == tree.Unary:
+            result = results.get(current.operand)
+            if current.op == "-":
+                result = -result
+        else:
+            result = apply_dual_operator(current.op, (results.get(current.left), None), 
+                                         (results.get(current.right), None), module)[0]
+        results[current] = result
+
+    adjoints = {node : 1.0}
+    for current in reversed(nodes):
+        adjoint = adjoints.get(current)
+        if adjoint is None or type(current) == tree.Number or type(current) == tree.Symbol:
+            continue
+        if type(current) == tree.Call:
+            outer = compile_expr(context.dev_trees.get(current.func), (ARG_PLACEHOLD,), context, backend)
+            contributions = [adjoint * outer(results.get(current.args[0]))]
+        elif type(current) == tree.Unary:
+            contributions = [-adjoint if current.op == "-" else adjoint]
+        else:
+            u, v = results.get(current.left), results.get(current.right)
+            if current.op == "+":
+                contributions = [adjoint, adjoint]
+            elif current.op == "-":
+                contributions = [adjoint, -adjoint]
+            elif current.op == "*":
+                contributions = [adjoint * v, adjoint * u]
+            else:
+                # no logarithm of the base if the exponent is constant
+                contributions = [adjoint * v * get_power(module)(u, v - 1), None]
+                if dependencies.get(current.right):
+                    contributions[1] = adjoint * results.get(current) * module.log(u)
+        for child, contribution in zip(tree.get_children(current), contributions):
+            if contribution is None or not dependencies.get(child):
+                continue
+            adjoint_child = adjoints.get(child)
+            adjoints[child] = contribution if adjoint_child is None else adjoint_child + contribution
+    value = results.get(node)
+    gradient = {}
+    for name in values:
+        # partial derivatives in the shape of the values, also
+        # for missing variables and those like x in 5*x
+        zeros = values.get(name) * 0.0
+        adjoint = adjoints.get(tree.Symbol(name))
+        gradient[name] = zeros if adjoint is None else adjoint + zeros
+    return value, gradient
@@ -0,0 +1,161 @@
+# coding: utf8
+"""
+Persistent cache of derivatives in an SQLite file, so that
+expressions that have been derived in earlier runs of the
+program are not derived again. The file can be used by several
+processes at once. Any error of the database is treated like
+a missing entry, the cache never stops a derivation.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+from data import *
+
+
+
+"""
+Cache of derivatives in the SQLite file 'path'. Has the same
+methods as 'util.LRUCache'. The least recently used entries are
+removed when the cache has more than 'maxsize' entries, which
+is checked after every 'DISK_CACHE_EVICT_INTERVAL' new entries.
+"""
+class PersistentCache(object):
+
+    """
+    @param path     string, path of the SQLite file
+    @param maxsize  int, maximum number of entries
+    """
+    def __init__(self, path, maxsize=DISK_CACHE_SIZE):
+        self.path = path
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.n_puts = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        # process that opened 'connection', a process
+        # that has been forked must open its own one
+        self.pid = None
+
+    """
+    Opens the database if it has not been opened by this process.
+    The lock must be held by the caller.
+
+    @return         sqlite3.Connection, connection to the database
+    """
+    def connect(self):
+        if self.connection is None or self.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=DISK_CACHE_TIMEOUT,
+                                         isolation_level=None, check_same_thread=False)
+            # readers and a writer of other processes do not block each other
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS derivatives "
+                               "(key TEXT PRIMARY KEY, derivative TEXT NOT NULL, used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS derivatives_used ON derivatives (used)")
+            self.connection = connection
+            self.pid = os.getpid()
+        return self.connection
+
+    """
+    @param key      string, key to look up
+    @param default  value to return if 'key' is not cached
+
+    @return         cached derivative of 'key', 'default' if there is none
+    """
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                connection = self.connect()
+                row = connection.execute("SELECT derivative FROM derivatives WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE derivatives SET used = ? WHERE key = ?", (time.time(), key))
+            except sqlite3.Error:
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return row[0]
+
+    """
+    Caches 'value' for 'key' and removes the least
+    recently used entries if the cache is full.
+
+    @param key      string, key of the entry
+    @param value    string, derivative to cache
+    """
+    def put(self, key, value):
+        with self.lock:
+            try:
+                connection = self.connect()
+                connection.execute("INSERT OR REPLACE INTO derivatives (key, derivative, used) VALUES (?, ?, ?)",
+                                   (key, value, time.time()))
+                self.n_puts += 1
+                if self.n_puts % DISK_CACHE_EVICT_INTERVAL == 0:
+                    self.evict()
+            except sqlite3.Error:
+                pass
+
+    """
+    Changes the maximum number of entries.
+
+    @param maxsize  int, new maximum number of entries
+    """
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            try:
+                self.evict()
+            except sqlite3.Error:
+                pass
+
+    """
+    Removes the least recently used entries until
+    there are not more than 'maxsize' entries.
+    The lock must be held by the caller.
+    """
+    def evict(self):
+        self.connect().execute("DELETE FROM derivatives WHERE key IN "
+                               "(SELECT key FROM derivatives ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                               (self.maxsize,))
+
+    """
+    Removes all entries and resets the counters.
+    """
+    def clear(self):
+        with self.lock:
+            try:
+                self.connect().execute("DELETE FROM derivatives")
+            except sqlite3.Error:
+                pass
+            self.hits = 0
+            self.misses = 0
+
+    """
+    @return         dictionary with the hits, misses,
+                    maximum size and current size
+    """
+    def info(self):
+        with self.lock:
+            try:
+                size = self.connect().execute("SELECT COUNT(*) FROM derivatives").fetchone()[0]
+            except sqlite3.Error:
+                size = -1
+            return {
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "maxsize" : self.maxsize,
+                "size" : size
+            }
+
+    """
+    Closes the connection of this process to the database.
+    """
+    def close(self):
+        with self.lock:
+            if self.connection is not None and self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+            self.pid = None
@@ -0,0 +1,180 @@
+# coding: utf8
+"""
+Registry of the elementary functions of the program. Functions
+like 'asin' or special functions of one's own are registered
+at runtime with their derivatives, known values and functions
+that evaluate them. A registry creates contexts with all of its
+functions, where the derivative templates are compiled and checked,
+the scanner for the function names is built and the compiled
+evaluators are cached per set of functions. There are no rules for
+the order of the functions, e.g. 'sinh' may stand before 'sin'.
+The functions registered with 'register_function(..)' are known by
+the interactive program and the batch mode, which derive with a
+context of 'REGISTRY', other methods get such a context passed.
+The default context of 'context.py' is never changed.
+"""
+import re
+import threading
+
+import tree
+import context as ctx
+
+from data import *
+
+
+
+# valid names of functions
+FUNCTION_NAME_REGEX = re.compile(r"[A-Za-z_]\w*$")
+
+
+"""
+Functions with their derivatives, values and implementations.
+A registry is filled with the functions of data.py when it is created.
+"""
+class FunctionRegistry(object):
+
+    """
+    @param functions    dictionary, functions and their derivatives,
+                        None for 'ELEM_FUNCTION_DEVS'
+    @param values       dictionary, known values of the functions,
+                        None for 'ELEM_FUNCTION_VALS'
+    """
+    def __init__(self, functions=None, values=None):
+        if functions is None:
+            functions = ELEM_FUNCTION_DEVS
+        if values is None:
+            values = ELEM_FUNCTION_VALS
+        self.lock = threading.Lock()
+        self.functions = dict(functions)
+        self.values = dict(values)
+        # functions that evaluate the elementary functions per backend
+        self.implementations = {}
+        # contexts of the current functions by their settings
+        self.contexts = {}
+
+    """
+    Registers the function 'name' or replaces it if it exists.
+    The derivative and the values are checked before the
+    function is registered.
+
+    @param name             string, name of the function
+    @param derivative       string, derivative with the placeholder
+                            'ARG_PLACEHOLD' like in 'ELEM_FUNCTION_DEVS'
+    @param values           dictionary, known values of the function,
+                            e.g. {"0" : "0"} for name{0} = 0
+    @param implementations  dictionary, function that evaluates 'name' for
+                            each backend of 'evaluate.py', e.g. {"math" : math.asin},
+                            backends that are missing use their function 'name'
+    """
+    def register(self, name, derivative, values=None, implementations=None):
+        if not FUNCTION_NAME_REGEX.match(name) or name == ARG_PLACEHOLD or name == "d":
+            raise ValueError("invalid name of a function: " + repr(name))
+        # raises a ValueError for an invalid derivative
+        ctx.DevTemplate(name, derivative)
+        calls = {}
+        for arg in values or {}:
+            call = name + "{" + str(arg) + "}"
+            value = values.get(arg)
+            if type(value) != str:
+                raise ValueError("invalid value of " + call + ": " + repr(value))
+            # raises a ValueError for an invalid argument or value
+            tree.parse(call)
+            tree.parse(value)
+            calls[call] = value
+        with self.lock:
+            self._remove(name)
+            self.functions[name] = derivative
+            self.values.update(calls)
+            for backend in implementations or {}:
+                self.implementations.setdefault(backend, {})[name] = implementations.get(backend)
+            self._clear_contexts()
+
+    """
+    Removes the function 'name' with its values and implementations.
+
+    @param name     string, name of the function
+    """
+    def unregister(self, name):
+        with self.lock:
+            self._remove(name)
+            self._clear_contexts()
+
+    """
+    Submethod of 'register(..)' and 'unregister(..)'.
+    The lock must be held by the caller.
+    """
+    def _remove(self, name):
+        self.functions.pop(name, None)
+        prefix = name + "{"
+        for call in [call for call in self.values if call.startswith(prefix)]:
+            del self.values[call]
+        for funcs in self.implementations.values():
+            funcs.pop(name, None)
+
+    """
+    Removes the cached contexts after the functions have changed 
+    and closes their persistent caches. A context that is still 
+    used elsewhere opens its persistent cache again when needed.
+    The lock must be held by the caller.
+    """
+    def _clear_contexts(self):
+        for context in self.contexts.values():
+            if context.disk_cache is not None:
+                context.disk_cache.close()
+        self.contexts.clear()
+
+    """
+    Creates a context with the registered functions. The same
+    context is returned for the same settings until the functions
+    change, settings that cannot be hashed always get a new context.
+
+    @param settings     keyword arguments for 'Context(..)'
+
+    @return             Context, settings of a derivation
+    """
+    def get_context(self, **settings):
+        key = tuple(sorted(settings.items()))
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        with self.lock:
+            context = self.contexts.get(key) if key is not None else None
+            if context is None:
+                context = ctx.Context(functions=self.functions, values=self.values,
+                                      implementations=self.implementations, **settings)
+                if key is not None:
+                    self.contexts[key] = context
+            return context
+
+
+# registry of the program
+REGISTRY = FunctionRegistry()
+
+
+"""
+Registers a function in 'REGISTRY', see 'FunctionRegistry.register(..)'.
+
+@return     Context, new context with the functions of 'REGISTRY'
+"""
+def register_function(name, derivative, values=None, implementations=None):
+    REGISTRY.register(name, derivative, values, implementations)
+    return REGISTRY.get_context()
+
+
+"""
+Removes a function from 'REGISTRY'.
+
+@return     Context, new context with the functions of 'REGISTRY'
+"""
+def unregister_function(name):
+    REGISTRY.unregister(name)
+    return REGISTRY.get_context()
+
+
+"""
+Creates a context with the functions of 'REGISTRY',
+see 'FunctionRegistry.get_context(..)'.
+"""
+def get_context(**settings):
+    return REGISTRY.get_context(**settings)
@@ -2,95 +2,33 @@
 """
 Methods to simplify an expression.
 """
+import math
+
 import util
-import brackets as br
+import tree
+import context as ctx
+import evaluate as ev
+import tracing
 
 from data import *
+from tree import Number, Symbol, Unary, Binary, Call
 
 
 
-"""
-Removes common elements from 'list_plus' and 'list_minus'.
-set() cannot be used here since it is important
-how often a certain element is shared between 
-both lists.
-
-@param list_plus    string list, first list
-@param list_minus   string list, second list
-
-@return             [list_plus, list_minus] with their 
-                    common parts removed
-"""
-def remove_common_plus_minus_parts(list_plus, list_minus):
-    tmp = list_minus[:]
-
-    for e in list_plus:
-        if e in list_minus:
-            list_minus.pop(list_minus.index(e))
-            
-    for e in tmp:
-        if e in list_plus:
-            list_plus.pop(list_plus.index(e))
-    
-    # if both lists are empty, one of them must carry a zero
-    if not list_plus and not list_minus:
-        list_plus = ["0"]
-    
-    return [list_plus, list_minus]
-
-
-"""
-Simplfies a given list of expressions that are connected
-through the '+' or '-' operator. 
-
-@param parts_plus   string list, expressions that are connected
-                    through the '+' operator
-@param parts_minus  string list, expressions that are connected
-                    through the '-' operator
-
-@return             two string lists, simplified versions for 
-                    'parts_plus' and 'parts_minus'
-"""
-def simplify_plus_minus_parts(parts_plus, parts_minus):
-    parts_plus = simplify_addition_parts(parts_plus)
-    parts_minus = simplify_addition_parts(parts_minus)
-    
-    # last element of simplified lists is the numerical sum or 0
-    last_plus = util.parse_number(parts_plus.pop())
-    util.debug_print(last_plus, 100)
-    last_minus = util.parse_number(parts_minus.pop())
-    util.debug_print(last_minus, 100)
-    sum_number =  last_plus - last_minus
-    if sum_number > 0:
-        parts_plus.append(str(abs(sum_number)))
-    elif sum_number < 0:
-        parts_minus.append(str(abs(sum_number)))
-    else:
-        # only append a 0 summand to 'parts_plus'
-        # if 'parts_plus' and 'parts_minus' 
-        # are both empty lists
-        if len(parts_plus) == 0 and len(parts_minus) == 0:
-            parts_plus.append(str(abs(sum_number)))
-    # if same parts are in parts_plus 
-    # and in parts_minus, remove them from both lists
-    # TODO: apply a distributive law in the future instead
-    parts_plus, parts_minus = remove_common_plus_minus_parts(parts_plus, parts_minus)
-    
-    return [parts_plus, parts_minus]
-
-    
 """
 Splits an expression at its + and - signs.
 E.g. "1+2+3-4+5" -> ['1', '2', '3', '5'], ['4']
 
-@param expr     string, expression to be split
+@param expr         string, expression to be split
+@param positions    int list, positions of the outer + and - signs
+                    if they are already known, None otherwise
 
 @return         two string lists, one with the parts that are
                 connected through a plus sign, and one 
                 with the parts that are connected through 
                 a minus sign
 """
-def operator_plus_minus_split(expr):
+def operator_plus_minus_split(expr, positions=None):
     parts_plus = []
     parts_minus = []
     n_expr = len(expr)
@@ -103,14 +41,12 @@ def operator_plus_minus_split(expr):
         sign = '-'
         idx = 1
         
-    pos_all_plus = util.get_pos_of_all_ops(expr, '+')
-    if sign == '-':
-        pos_all_minus = util.get_pos_of_all_ops(expr[idx:], '-')
-        pos_all_minus[:]=[i+1 for i in pos_all_minus]
+    if positions is None:
+        pos_all_plus = util.get_pos_of_all_ops(expr, '+')
+        pos_all_minus = util.get_pos_of_all_ops(expr, '-', idx)
+        pos_all_ops = sorted([*pos_all_plus, *pos_all_minus])
     else:
-        pos_all_minus = util.get_pos_of_all_ops(expr, '-')
-    
-    pos_all_ops = sorted([*pos_all_plus, *pos_all_minus])
+        pos_all_ops = [pos for pos in positions if pos >= idx]
     pos_all_ops.append(n_expr)
     
     for pos_op in pos_all_ops:
@@ -130,339 +66,551 @@ def operator_plus_minus_split(expr):
 Splits an expression at any other operator than
 + or -.
 
-@param expr     string, expression to be split
-@param op       char, operator to split at
+@param expr         string, expression to be split
+@param op           char, operator to split at
+@param positions    int list, positions of the outer operators 'op'
+                    if they are already known, None otherwise
 
 @return         string list with the parts that
                 resulted from the split
 """
-def operator_other_split(expr, op):
+def operator_other_split(expr, op, positions=None):
+    if positions is None:
+        positions = util.get_pos_of_all_ops(expr, op)
     parts = []
-    pos_op = -1
     i = 0
-    n_expr = len(expr)
-    while i < n_expr:
-        pos_op = util.get_pos_of_first_op(expr[i:n_expr], op)
-        if pos_op != -1:
-            parts.append(expr[i:i+pos_op])
-            i += pos_op + 1
-        else:
-            parts.append(expr[i:n_expr])
-            i = n_expr
+    for pos_op in positions:
+        parts.append(expr[i:pos_op])
+        i = pos_op + 1
+    parts.append(expr[i:])
     return parts
 
 
 """
 Splits an expression 'expr' at the operator 'op'.
 
-@param expr     string, expression to be split up
-@param op       char, operator to split at
+@param expr         string, expression to be split up
+@param op           char, operator to split at
+@param positions    int list, positions of the outer operators 
+                    to split at if they are already known, None otherwise
 
 @return         string list with the splitted parts of 'expr'
 """
-def operator_split(expr, op):
+def operator_split(expr, op, positions=None):
     if OPERATORS_DICT.get(op) == 0:
-        parts = operator_plus_minus_split(expr)
+        parts = operator_plus_minus_split(expr, positions)
     else:
-        parts = operator_other_split(expr, op)
+        parts = operator_other_split(expr, op, positions)
     
     return parts
 
 
 """
-Splits an expression 'expr' at the operator with 
-lowest precedence in that expression.
+Simplifies 'expr' until there is nothing more to simplify.
+It furthermore inserts the specific values 
+from ELEM_FUNCTION_VALS in data.py.
+The expression is parsed once and simplified 
+by 'simplify_tree(..)'.
 
-@param expr     string, expression to be split
+@param expr     string, expression to simplify
+@param stats    dictionary, if given, the number of passes and
+                rewrites of 'simplify_tree(..)' are added
 
-@return         string array with the splitted parts of 'expr'
-                or a list with only 'expr' if no split was possibles
+@return         string, simplified expression
 """
-def lowest_precedence_operator_split(expr):
-    parts = []
-    offset = 0
-    pos = util.get_pos_of_first_lowest_precedence_op(expr)
-    # in this case not an operator, but a sign has been found
-    if pos == 0:
-        offset = 1
-        pos = util.get_pos_of_first_lowest_precedence_op(expr[1:])
-    if pos == -1:
-        return [expr]
-    op = expr[pos+offset]
-    parts = operator_split(expr, op)
-    return op, parts
-
-
-"""
-Sorts a list of parts with parts that are numbers
-in the first place, then parts that are elemental
-function in the order of the list ELEM_FUNCTIONS,
-and then the other parts Submethod to be called
-recursively from the method without suffix _sub.
-
-@param parts    string list, list of parts to order
-
-@return         string list, list of sorted parts
-"""
-def sort_string_parts_sub(parts):
-    # first sort list with sorted() function,
-    # this applies and alphabetical order AND
-    # puts parts that are pure numbers in the beginning
-    parts = sorted(parts)
-    parts_sorted = []
-    # then - to create a more natural order - 
-    # sort the pre-ordered list according
-    # to the order of the list ELEM_FUNCTIONS
-    for elem_func in ELEM_FUNCTIONS:
-        for part in parts:
-            if part.startswith(elem_func):
-                parts_sorted.append(part)
-                parts.remove(part)
-    # add the remaining parts to the sorted list
-    for part in parts:
-        parts_sorted.append(part)
-    
-    return parts_sorted 
+def simplify(expr, stats=None):
+    return tree.to_string(simplify_tree(tree.parse(expr), stats))
 
 
 """
-Sorts a list of parts with parts that are numbers
-in the first place, then parts that are elemental
-function in the order of the list ELEM_FUNCTIONS,
-and then the other parts.
+Creates a number node, floats without decimal places
+are converted to int, e.g. 2.0 -> 2.
 
-@param parts    string list, list of parts to order
+@param value    int or float, value of the number
 
-@return         string list, list of sorted parts
+@return         node, number node
 """
-def sort_string_parts(parts):
-    parts_new = sort_string_parts_sub(parts)
-    if parts_new != parts:
-        parts = parts_new
-        parts_new = sort_string_parts(parts)
-    return parts
+def number_tree(value):
+    if type(value) == float and value.is_integer():
+        value = int(value)
+    return Number(value)
 
 
 """
-Simplfies a given list of expressions that are connected
-through the '+' or '-' operator. 
+Splits 'node' at its outer '+' and '-' operators and signs.
+Negative numbers are turned into subtracted positive numbers.
+
+@param node         node, expression tree to be split
+@param is_negative  boolean, True if 'node' itself is subtracted
+@param summands     list of (boolean, node) tuples, to which
+                    the summands and whether they are subtracted
+                    are appended
+"""
+def split_summands_tree(node, is_negative, summands):
+    for is_negative_summand, summand in tree.split_summands(node, is_negative):
+        if type(summand) == Number and summand.value < 0:
+            summands.append((not is_negative_summand, Number(-summand.value)))
+        else:
+            summands.append((is_negative_summand, summand))
+
 
-@param parts    string list, expressions that are connected
-                through the '+' or '-' operator
-                
-@return         string list, simplified expressions that are 
-                connected through the '+' operator
 """
-def simplify_addition_parts(parts):
-    parts_simplified = []
-    
-    summand_number = 0
-    
-    for part in parts:
-        summand_part = util.parse_number(part)
-        if type(summand_part) != str:
-            summand_number += summand_part
+Splits 'node' at its outer '*' operators.
+
+@param node     node, expression tree to be split
+@param factors  node list, to which the factors are appended
+"""
+def split_factors_tree(node, factors):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if type(node) == Binary and node.op == "*":
+            stack.append(node.right)
+            stack.append(node.left)
+        else:
+            factors.append(node)
+
+
+"""
+Connects the nodes of 'parts' through the operator 'op'.
+
+@param parts    node list, parts to connect
+@param op       char, operator to connect the parts with
+
+@return         node, connected parts
+"""
+def join_tree(parts, op):
+    node = parts[0]
+    for part in parts[1:]:
+        node = Binary(op, node, part)
+    return node
+
+
+"""
+Splits a summand into its numerical coefficient
+and the rest of the product, e.g. 3*x^2 -> 3, x^2.
+
+@param node     node, simplified summand
+
+@return         (number, node) tuple, coefficient and rest
+"""
+def split_coefficient_tree(node):
+    if type(node) == Binary and node.op == "*" and type(node.left) == Number:
+        return node.left.value, node.right
+    return 1, node
+
+
+"""
+Collects like terms, e.g. 2*x+3*x-x -> 4*x. The coefficients
+of like terms are added up in a dictionary with the structural
+hash of the rest of each product as key, the terms keep the 
+order in which they first occur.
+
+@param summands     list of (boolean, node) tuples, simplified summands 
+                    which are no numbers and whether they are subtracted
+
+@return             two node lists, terms that are added and
+                    terms that are subtracted
+"""
+def collect_terms_tree(summands):
+    # terms by their structural hash, so that terms that only differ 
+    # in the order of their summands or factors are collected as well
+    terms = {}
+    coefficients = {}
+    for is_negative, part in summands:
+        coefficient, term = split_coefficient_tree(part)
+        key = tree.structural_hash(term)
+        terms.setdefault(key, term)
+        coefficients[key] = coefficients.get(key, 0) + (-coefficient if is_negative else coefficient)
+    parts_plus = []
+    parts_minus = []
+    for key, coefficient in coefficients.items():
+        term = terms.get(key)
+        if coefficient == 0:
             continue
-        parts_simplified.append(part)
-    
-    parts_simplified.append(str(summand_number))
-    
-    return parts_simplified
+        if abs(coefficient) != 1:
+            term = Binary("*", number_tree(abs(coefficient)), term)
+        if coefficient > 0:
+            parts_plus.append(term)
+        else:
+            parts_minus.append(term)
+    return parts_plus, parts_minus
 
 
 """
-Simplfies a given list of expressions that are connected
-through the '*' operator. The list of expressions comes out sorted, 
-with numbers being in the beginning of the list.
+Simplifies a node whose outer operator is '+', '-' or a sign 
+and whose summands have already been simplified. Numbers are
+added up and like terms are collected.
+
+@param node     node, expression tree to be simplified
 
-@param parts    string list, expressions that are connected
-                through the '*' operator
-                
-@return         string list, simplified expressions that are 
-                connected through the '*' operator
+@return         node, simplified expression tree
 """
-def simplify_multiplication_parts(parts):
-    parts_simplified = []
-    
-    parts_rest = []
-    
+def simplify_sum_tree(node):
+    summands = []
+    split_summands_tree(node, False, summands)
+    sum_number = 0
+    terms = []
+    for is_negative, part in summands:
+        if type(part) == Number:
+            sum_number += -part.value if is_negative else part.value
+        else:
+            terms.append((is_negative, part))
+    parts_plus, parts_minus = collect_terms_tree(terms)
+    if sum_number > 0:
+        parts_plus.append(number_tree(sum_number))
+    elif sum_number < 0:
+        parts_minus.append(number_tree(-sum_number))
+    if not parts_plus and not parts_minus:
+        return Number(0)
+    if parts_plus:
+        node = join_tree(parts_plus, "+")
+    else:
+        node = Unary("-", parts_minus.pop(0))
+    for part in parts_minus:
+        node = Binary("-", node, part)
+    return node
+
+
+"""
+Gets the position of a factor in the order of a simplified
+product: symbols first, then elemental functions in the order 
+of the functions of the context, then the other factors.
+
+@param node     node, factor of a product
+@param context  Context, settings of the simplification, None for the default
+
+@return         int, rank of 'node' in a product
+"""
+def get_factor_rank(node, context=None):
+    function_ranks = ctx.get_context(context).function_ranks
+    if type(node) == Binary and node.op == "^":
+        node = node.left
+    if type(node) == Symbol:
+        return 0
+    if type(node) == Call and node.func in function_ranks:
+        return 1 + function_ranks.get(node.func)
+    return 1 + len(function_ranks)
+
+
+"""
+Gets the key by which the factors of a simplified product
+are sorted, so that all products of the same factors are 
+written in the same canonical order, e.g. b*a -> a*b. Factors
+are sorted by their rank, then by the names of their symbols
+and functions and then by their structural hash.
+
+@param node     node, factor of a product
+@param context  Context, settings of the simplification, None for the default
+
+@return         tuple, key of 'node'
+"""
+def get_factor_key(node, context=None):
+    base = node
+    if type(base) == Binary and base.op == "^":
+        base = base.left
+    if type(base) == Symbol:
+        name = base.name
+    elif type(base) == Call:
+        name = base.func
+    else:
+        name = ""
+    return (get_factor_rank(node, context), name, tree.structural_hash(node))
+
+
+"""
+Simplifies a product. Multiplies the numbers of a product and merges factors with the same base.
+The factors must have already been simplified.
+
+@param node     node, expression tree with '*' as outer operator
+@param context  Context, settings of the simplification, None for the default
+
+@return         node, simplified expression tree
+"""
+def simplify_product_tree(node, context=None):
+    factors = []
+    split_factors_tree(node, factors)
     factor_number = 1
-    
-    potences = []
-    exponent_number = 0
-    exponent_string = ""
-    exponent_string_parts = []
-    
-    for part in parts:
-        factor_part = util.parse_number(part)
-        if type(factor_part) != str:
-            if factor_part == 0:
-                return ["0"]
-            factor_number *= factor_part
+    # bases by their structural hash and their exponents
+    bases = {}
+    exponents = {}
+    for factor in factors:
+        # simplified factors can carry a sign
+        if type(factor) == Unary:
+            factor_number = -factor_number
+            split_factors_tree(factor.operand, factors)
             continue
-        if part == ARG:
-            potences.append("1")
+        if type(factor) == Number:
+            factor_number *= factor.value
             continue
-        part_sub = operator_split(part, "^")
-        if len(part_sub) == 2 and part_sub[0].startswith(ARG):
-            potences.append(part_sub[1])
-            continue
-        parts_rest.append(part)
-    
-    # add number first
-    if factor_number != 1:
-        parts_simplified.append(str(factor_number))
-        
-    # then add ARG^(..) terms
-    for potence in potences:
-        potence_parsed = util.parse_number(potence)
-        
-        if type(potence_parsed) == str:
-            exponent_string_parts.append(potence_parsed)
+        if type(factor) == Binary and factor.op == "^":
+            base, exponent = factor.left, factor.right
         else:
-            exponent_number += potence_parsed
-    N_exponent_string_parts = len(exponent_string_parts)
-    if N_exponent_string_parts > 0 and exponent_number > 0:
-        exponent_string += "(" + "+".join(exponent_string_parts) + "+"
-        exponent_string += str(exponent_number)
-        exponent_string += ")"
-        parts_simplified.append(ARG + "^" + exponent_string)
-    elif N_exponent_string_parts > 0:
-        exponent_string += "+".join(exponent_string_parts)
-        if N_exponent_string_parts > 1:
-            exponent_string = "(" + exponent_string + ")"
-        parts_simplified.append(ARG + "^" + exponent_string)
-    elif exponent_number > 0:
-        if exponent_number == 1:
-            parts_simplified.append(ARG)
-        else:
-            exponent_string = str(exponent_number)
-            parts_simplified.append(ARG + "^" + exponent_string)
-    elif exponent_number != 0:
-        exponent_string = "(" + str(exponent_number) + ")"
-        parts_simplified.append(ARG + "^" + exponent_string)
-    
-    # then add the other parts sorted
-    parts_simplified += sort_string_parts(parts_rest) 
-    
-    # if the simplified list is emptry, the product is 1
-    if not parts_simplified:
-        parts_simplified = ["1"]
-    
-    return parts_simplified
+            base, exponent = factor, Number(1)
+        key = tree.structural_hash(base)
+        bases.setdefault(key, base)
+        exponents.setdefault(key, []).append(exponent)
+    if factor_number == 0:
+        return Number(0)
+    parts = []
+    for key in exponents:
+        part = simplify_power_tree(bases.get(key), simplify_sum_tree(join_tree(exponents.get(key), "+")))
+        if not tree.is_number(part, 1):
+            parts.append(part)
+    parts = sorted(parts, key=lambda part: get_factor_key(part, context))
+    if not parts:
+        return number_tree(factor_number)
+    node = join_tree(parts, "*")
+    if abs(factor_number) != 1:
+        node = Binary("*", number_tree(abs(factor_number)), node)
+    if factor_number < 0:
+        node = Unary("-", node)
+    return node
 
 
 """
-Simplfies a given list of expressions that are connected
-through the '^' operator.
+Simplifies a power with numbers in its base or exponent.
 
-@param parts    string list, expressions that are connected
-                through the '^' operator
-                
-@return         string list, simplified expressions that are 
-                connected through the '^' operator
+@param base         node, simplified base of the power
+@param exponent     node, simplified exponent of the power
+
+@return             node, simplified power
 """
-def simplify_potential_parts(parts):
-    num_first = util.parse_number(parts[0])
-    if num_first == 1:
-        return ["1"]
-    
-    # since ^ is not commutative, now only look at the last two parts
-    # and let the recursion of 'simplify' do the magic 
-    num_last = util.parse_number(parts[-1])
-    num_pre_last = util.parse_number(parts[-2])
-    
-    if type(num_pre_last) != str and type(num_last) != str:
-        return parts[:-2]+[str(num_pre_last ** num_last)]
-    if num_pre_last == 1 or num_last == 0:
-        if len(parts) > 2:
-            return parts[:-2]
+def simplify_power_tree(base, exponent):
+    if tree.is_number(exponent, 0) or tree.is_number(base, 1):
+        return Number(1)
+    if tree.is_number(exponent, 1):
+        return base
+    if type(base) == Number and type(exponent) == Number:
+        # negative numbers have no real roots
+        if base.value >= 0 or type(exponent.value) == int:
+            try:
+                return number_tree(base.value ** exponent.value)
+            except (ZeroDivisionError, OverflowError):
+                pass
+    return Binary("^", base, exponent)
+
+
+"""
+Gets the value of a folded number, a number or
+a negative number like '-2'.
+
+@param node     node, expression tree
+
+@return         float, value of 'node', None if it is no number
+"""
+def get_folded_value(node):
+    if type(node) == Unary and node.op == "-" and type(node.operand) == Number:
+        return -float(node.operand.value)
+    if type(node) == Number:
+        return float(node.value)
+    return None
+
+
+"""
+Evaluates 'node' to a number if the context folds constants 
+to floats and all operands of 'node' are numbers, e.g. sin{2}
+or 2^(-1). The constants of 'EVAL_CONSTANTS' are evaluated as
+well. Since operands are simplified first, a subtree without
+symbols becomes a single number in the same traversal. Results
+that are not finite real numbers are not folded, e.g. log{-1}.
+Negative results are built as a sign and a positive number, the
+form the simplification of sums and products expects.
+
+@param node     node, expression tree whose operands are simplified
+@param context  Context, settings of the simplification, None for the default
+
+@return         node, number node, 'node' itself if it is not folded
+"""
+def fold_constant_tree(node, context=None):
+    context = ctx.get_context(context)
+    if context.fold_policy != FOLD_FLOAT:
+        return node
+    if type(node) == Symbol:
+        if node.name in EVAL_CONSTANTS:
+            return number_tree(EVAL_CONSTANTS.get(node.name))
+        return node
+    # a sign before a number is the folded form of a negative number
+    if type(node) == Unary and node.op == "-" and type(node.operand) == Number:
+        return node
+    values = [get_folded_value(child) for child in tree.get_children(node)]
+    if not values or None in values:
+        return node
+    try:
+        if type(node) == Call:
+            implementation = ev.get_implementation(node.func, math, context)
+            if implementation is None:
+                return node
+            value = implementation(*values)
+        elif type(node) == Unary:
+            value = -values[0] if node.op == "-" else values[0]
         else:
-            return ["1"]
-    if num_last == 1:
-        return parts[:-1]
-    if type(num_last) == str:
-        return parts
-    return parts
+            value = ev.apply_dual_operator(node.op, (values[0], None), (values[1], None), math)[0]
+    except (ValueError, ArithmeticError):
+        return node
+    if type(value) != float or not math.isfinite(value):
+        return node
+    if value < 0:
+        return Unary("-", number_tree(-value))
+    return number_tree(value)
 
 
 """
-Simplifies a given expression. Will later be called in a
-recursive loop.
+Applies one simplification step to 'node' whose 
+children have already been simplified.
 
-@param expr     string, expression to simplify
+@param node     node, expression tree to simplify
+@param context  Context, settings of the simplification, None for the default
 
-@return         string, simplified expression
+@return         node, rewritten expression tree, 'node' itself
+                if there is nothing to simplify
 """
-def simplify_sub(expr):
-    util.debug_print("Simplify:\t"+expr, 10)
-    expr_simp = ""
-    parts_split = lowest_precedence_operator_split(expr)
-    util.debug_print("After lowest Precedence operator split:", 100)
-    util.debug_print(parts_split, 100)
-    parts = []
-    parts_plus = []
-    parts_minus = []
-    op = ""
-    
-    # if no split could be made, there are brackets, functions, or there is nothing to simplify
-    if not len(parts_split) == 2:
-        # look for brackets
-        for bracket in BRACKETS:
-            if expr[0] == bracket:
-                expr_simp += bracket + simplify_sub(expr[1:-1]) + BRACKETS.get(bracket)     
-                return expr_simp
-        # look for functions
-        elem_func = util.get_elem_func(expr, 0)
-        if elem_func != "":
-            expr_simp += elem_func + "{" + simplify_sub(expr[len(elem_func)+1:-1]) + "}"
-            return expr_simp
-        # if also no functions could be found, there is nothing to simplify
-        return expr
-    
-    op = parts_split[0]
-    parts = parts_split[1]
-    if op == "+" or op == "-":
-        parts_plus = parts[0]
-        parts_minus = parts[1]
-        parts_plus, parts_minus = simplify_plus_minus_parts(parts_plus, parts_minus)
-        for part in parts_plus:
-            expr_simp += simplify_sub(part) + '+'
-        # remove last plus sign
-        expr_simp = expr_simp[:-1]
-        for part in parts_minus:
-            expr_simp += '-' + simplify_sub(part)
-    else:        
-        if op == "*":
-            parts = simplify_multiplication_parts(parts)
-        elif op == "^":
-            parts = simplify_potential_parts(parts)       
-        for part in parts:
-            expr_simp += simplify_sub(part) + op
-        # remove last operator
-        expr_simp = expr_simp[:-len(op)]
-    return expr_simp
-
-
-"""
-Calls the simplify_sub method from above in a recursive procedure
-until there is nothing more to simplify. 
-It furthermore inserts the specific values 
-from ELEM_FUNCTION_VALS in data.py.
+def rewrite_tree(node, context=None):
+    node_folded = fold_constant_tree(node, context)
+    if node_folded is not node:
+        return node_folded
+    if type(node) == Call:
+        return ctx.get_context(context).value_trees.get(node, node)
+    if type(node) == Unary:
+        return simplify_sum_tree(node)
+    if type(node) != Binary:
+        return node
+    if OPERATORS_DICT.get(node.op) == 0:
+        return simplify_sum_tree(node)
+    if node.op == "*":
+        return simplify_product_tree(node, context)
+    return simplify_power_tree(node.left, node.right)
 
-@param expr     string, expression to simplify
 
-@return         string, simplified expression
 """
-def simplify(expr):
-    for elem_func_val in ELEM_FUNCTION_VALS:
-        expr = expr.replace(elem_func_val, ELEM_FUNCTION_VALS.get(elem_func_val))
-    # remove brackets before starting
-    # the other simplifications
-    expr_simp = br.remove_brackets(expr)
-    util.debug_print(expr_simp, 10)
-    expr_simp = simplify_sub(expr_simp)
-    # recursively repeat until 'simplify' does not change the string anymore
-    if expr_simp == expr:
-        return expr_simp
-    return simplify(expr_simp)
+Checks if 'node' is a sum, i.e. its outer operator is '+', '-' or a sign.
+
+@param node     node, node to be checked
+
+@return         boolean, True if 'node' is a sum
+"""
+def is_sum_tree(node):
+    return type(node) == Unary or (type(node) == Binary and OPERATORS_DICT.get(node.op) == 0)
+
+
+"""
+Gets the operands of 'node' that are simplified before 'node' itself:
+all summands of a sum, all factors of a product and the children of 
+any other node. The nested '+' or '*' nodes of a long sum or product
+are thus not simplified one by one.
+
+@param node     node, node whose operands are wanted
+
+@return         node list, operands of 'node'
+"""
+def get_operands_tree(node):
+    if is_sum_tree(node):
+        return [summand for _, summand in tree.split_summands(node)]
+    if type(node) == Binary and node.op == "*":
+        factors = []
+        split_factors_tree(node, factors)
+        return factors
+    return list(tree.get_children(node))
+
+
+"""
+Creates a node like 'node' with new operands.
+
+@param node         node, node to be copied
+@param operands     node list, new operands in the order of 'get_operands_tree(..)'
+
+@return             node, node with the new operands, 'node' itself 
+                    if the operands have not changed
+"""
+def replace_operands_tree(node, operands):
+    operands_old = get_operands_tree(node)
+    if all(operand is operand_old for operand, operand_old in zip(operands, operands_old)):
+        return node
+    if is_sum_tree(node):
+        signs = [is_negative for is_negative, _ in tree.split_summands(node)]
+        return tree.join_summands(list(zip(signs, operands)))
+    if type(node) == Binary and node.op == "*":
+        return join_tree(operands, "*")
+    return tree.replace_children(node, operands)
+
+
+"""
+Tree version of 'simplify(..)'. Simplifies the subtrees of
+'node' with a worklist: a node is only rewritten once all its
+operands are simplified, and only nodes that have been changed 
+by a rewrite are put on the worklist again. Each node is thus
+simplified only once instead of simplifying the whole tree 
+again until it does not change anymore. The worklist is an 
+explicit stack, so there is no limit for the depth of the tree.
+
+@param node     node, expression tree to simplify
+@param stats    dictionary, if given, the number of 'passes' (nodes
+                that have been tried to rewrite) and the number of 
+                'rewrites' (nodes that have been changed) are added
+@param context  Context, settings of the simplification, None for the default
+
+@return         node, simplified expression tree
+"""
+@tracing.traced
+def simplify_tree(node, stats=None, context=None):
+    cache = ctx.get_context(context).simplify_cache
+    passes = 0
+    rewrites = 0
+    # simplified versions of the nodes that are done
+    done = {}
+    # nodes that have been rewritten to another node 
+    # which is not yet simplified
+    forward = {}
+    worklist = [node]
+    while worklist:
+        current = worklist[-1]
+        if current in done:
+            worklist.pop()
+            continue
+        target = forward.get(current)
+        if target is not None:
+            if target in done:
+                done[current] = done.get(target)
+                cache.put(current, done.get(current))
+                worklist.pop()
+            else:
+                worklist.append(target)
+            continue
+        if type(current) == Number:
+            done[current] = current
+            worklist.pop()
+            continue
+        if type(current) == Symbol:
+            done[current] = fold_constant_tree(current, context)
+            worklist.pop()
+            continue
+        node_simp = cache.get(current)
+        if node_simp is not None:
+            done[current] = node_simp
+            worklist.pop()
+            continue
+        operands = get_operands_tree(current)
+        operands_dirty = [operand for operand in operands if operand not in done]
+        if operands_dirty:
+            worklist.extend(operands_dirty)
+            continue
+        rebuilt = replace_operands_tree(current, [done.get(operand) for operand in operands])
+        node_simp = rewrite_tree(rebuilt, context)
+        passes += 1
+        # rewrites that lead back to 'current', e.g. A -> B -> A,
+        # would be followed forever, so the chain ends here
+        target = node_simp
+        while target is not None and target is not current:
+            target = forward.get(target)
+        if node_simp is rebuilt or target is current:
+            done[current] = rebuilt
+            done[rebuilt] = rebuilt
+            cache.put(current, rebuilt)
+            worklist.pop()
+        else:
+            rewrites += 1
+            forward[current] = node_simp
+    if stats is not None:
+        stats["passes"] = stats.get("passes", 0) + passes
+        stats["rewrites"] = stats.get("rewrites", 0) + rewrites
+    return done.get(node)
@@ -4,6 +4,7 @@ Checks for incorrect syntax of an expression
 and corrects it whenever possible.
 """
 import util
+import tracing
 
 from data import *
 
@@ -29,6 +30,9 @@ def modify_with_replacements(expr):
 Gets the position of the closing bracket
 when brackets have to be add to an expression
 after a certain operator, e.g. for x^-1 -> x^(-1).
+The operand ends before the next operator that is 
+not enclosed by brackets, at the latest at the end
+of the brackets that enclose 'pos_i'.
 
 @param expr     string, expression add brackets
 @param pos_i    int, position of the opening bracket
@@ -36,7 +40,8 @@ after a certain operator, e.g. for x^-1 -> x^(-1).
 @return         int, position of the closing bracket
 """
 def get_pos_for_closing_bracket(expr, pos_i):
-    pos_op_list = []
+    index = util.get_bracket_index(expr)
+    pos_f = index.get_enclosing_end(pos_i)
     
     # '^' should never result in a break, e.g.:
     # x*-1^2 -> x*(-1^2)
@@ -45,136 +50,63 @@ def get_pos_for_closing_bracket(expr, pos_i):
     # add '/' to get a break at '/'
     operators.append('/')
     
-    
-    for bracket_open in BRACKETS_OPEN:
-    # only expressions with no operators 
-    # at the end have passed the 'has_correct_syntax()' 
-    # method that was run before
-        if expr[pos_i+1] == bracket_open:
-            # find closing bracket
-            pos_f = util.get_closed_bracket_pos(expr, pos_i+1)
-            return pos_f
-    
     for op in operators:
-        pos_op = util.get_pos_of_first_op(expr[pos_i+1:], op)
+        pos_op = index.get_pos_of_first_op(op, pos_i+1, pos_f)
+        # a sign directly after another operator 
+        # belongs to the operand, e.g. x*-y^-2
+        while pos_op > -1 and expr[pos_op-1] in operators+['^']:
+            pos_op = index.get_pos_of_first_op(op, pos_op+1, pos_f)
         if pos_op > -1:
-            pos_op_list.append(pos_op)
-    if pos_op_list:
-        pos_f = pos_i+1+min(pos_op_list)
-        return pos_f
-    # if neither another operator nor another bracket have been found,
-    # the closing bracket must be placed at the end of the expression
-    return len(expr)
+            pos_f = pos_op
+    return pos_f
 
 
 """
-Submethod of 'modify_signs_after_operators(expr)'. 
 Changes combinations of *-SOME_EXPRESSION 
 and ^-SOME_EXPRESSION to *(-SOME_EXPRESSION)
-and to ^(-SOME_EXPRESSION) in a substring of 'expr'.
+and to ^(-SOME_EXPRESSION). All brackets are 
+found in 'expr' first and then inserted at once.
 
 @param expr     string, expression to be modified
-@param pos      int, position of first char 
-                of subexpress of 'expr'
 
-@return         modified expression
+@return         string, modified expression
 """
-def modify_signs_after_operators_sub(expr, pos):
+def modify_signs_after_operators(expr):
     ops_left = ['*', '^']
     ops_right = ['+', '-']
-    
-    pos_op = -1
-    pos_ops = []
-    pos_i = -1
-    pos_f = -1
-    
-    expr_sub = expr[pos:]
-    
-    for op_left in ops_left:    
-        pos_op = expr_sub.find(op_left)
-        if pos_op > -1:
-            pos_ops.append(pos_op)
-    if not pos_ops:
-        return expr
-    pos_op = min(pos_ops)
-        
+    edits = []
     # only expressions with no operators 
     # at the end have passed the 'has_correct_syntax()' 
     # method that was run before
-    pos_i = pos_op+1
-    ch = expr_sub[pos_i]
-    for op_right in ops_right:
-        if ch == op_right:
-            pos_f = get_pos_for_closing_bracket(expr_sub, pos_i)
-            break
-    #wrap into brackets
-    if pos_f > -1:
-        expr_sub = expr_sub[:pos_i]+'('+expr_sub[pos_i:pos_f]+')'+expr_sub[pos_f:]
-        expr = expr[:pos] + expr_sub
-    
-    return modify_signs_after_operators_sub(expr, pos+pos_op+1)
-
-
-"""
-Changes combinations of *-SOME_EXPRESSION 
-and ^-SOME_EXPRESSION to *(-SOME_EXPRESSION)
-and to ^(-SOME_EXPRESSION)
-
-@param expr     string, expression to be modified
-
-@return         string, modified expression
-"""
-def modify_signs_after_operators(expr):
-    return modify_signs_after_operators_sub(expr, 0)
-
-
-"""
-Submethod of 'modify_division_operators(expr)'. 
-Changes combinations of *-SOME_EXPRESSION 
-and ^-SOME_EXPRESSION to *(-SOME_EXPRESSION)
-and to ^(-SOME_EXPRESSION) in a substring of 'expr'.
+    for pos_op in range(len(expr)-1):
+        if expr[pos_op] in ops_left and expr[pos_op+1] in ops_right:
+            pos_i = pos_op+1
+            pos_f = get_pos_for_closing_bracket(expr, pos_i)
+            # wrap into brackets, closing brackets 
+            # before opening ones at the same position
+            edits.append((pos_i, 1, '(', 0))
+            edits.append((pos_f, 0, ')', 0))
+    return util.apply_edits(expr, edits)
 
-@param expr     string, expression to be modified
-@param pos      int, position of first char 
-                of subexpress of 'expr'
-
-@return         modified expression
-"""
-def modify_division_operators_sub(expr, pos):
-    pos_op = -1
-    pos_i = -1
-    pos_f = -1
-    
-    expr_sub = expr[pos:]
-    
-    pos_op = expr_sub.find('/')
-    
-    # only expressions with no operators 
-    # at the end have passed the 'has_correct_syntax()' 
-    # method that was run before
-    pos_i = pos_op+1
-    
-    if pos_op == -1:
-        return expr
-    
-    pos_f = get_pos_for_closing_bracket(expr_sub, pos_op)
-    
-    if pos_f > -1:
-        expr_sub = expr_sub[:pos_op]+'*('+expr_sub[pos_i:pos_f]+')^(-1)'+expr_sub[pos_f:]
-        expr = expr[:pos] + expr_sub
-    
-    return modify_division_operators_sub(expr, pos+pos_op+1)
-            
     
 """
-Changes all division operators '/..' to '*(..)^-1' 
+Changes all division operators '/..' to '*(..)^-1'.
+All replacements are found in 'expr' first and 
+then applied at once.
 
 @param expr     string, expression to be modified
 
 @return         string, modified expression
 """
 def modify_division_operators(expr):
-    return modify_division_operators_sub(expr, 0)
+    edits = []
+    pos_op = expr.find('/')
+    while pos_op > -1:
+        pos_f = get_pos_for_closing_bracket(expr, pos_op)
+        edits.append((pos_op, 1, '*(', 1))
+        edits.append((pos_f, 0, ')^(-1)', 0))
+        pos_op = expr.find('/', pos_op+1)
+    return util.apply_edits(expr, edits)
 
 
 """
@@ -185,6 +117,7 @@ syntax errors or eliminating division operators.
 
 @return         string, modified expression
 """
+@tracing.traced
 def modify_input(expr):
     expr = modify_division_operators(expr)
     expr = modify_signs_after_operators(expr)
@@ -202,17 +135,10 @@ open bracket in the expression 'expr'.
                 False otherwise
 """
 def has_incorrect_bracket_syntax(expr):
-    n_expr = len(expr)
     # bracket count for each bracket type
-    bc = [0]*N_BRAC
-    for i, ch in enumerate(expr):
-        for j, bracket in enumerate(BRACKETS):
-            if ch == bracket:
-                bc[j] += 1
-            elif ch == BRACKETS.get(bracket):
-                bc[j] -= 1
-    for i, _ in enumerate(BRACKETS):
-        if bc[i] != 0:
+    bracket_counts = util.get_bracket_index(expr).bracket_counts
+    for bracket in BRACKETS:
+        if bracket_counts.get(bracket) != 0:
             return True
     return False
 
@@ -273,8 +199,9 @@ in the given expression, e.g. '+)' or '-*'.
 def has_incorrect_operator_syntax(expr):
     n_expr = len(expr)
     # create a new temperary operator dict 
-    # which also contains '/' and its precedence
-    operators = OPERATORS_DICT
+    # which also contains '/' and its precedence,
+    # 'OPERATORS_DICT' is never modified
+    operators = dict(OPERATORS_DICT)
     operators['/'] = 1
     
     for i, ch in enumerate(expr):
@@ -316,6 +243,7 @@ Checks if the syntax of expression 'expr' is correct.
                 False if syntax is correct, 
                 True otherwise
 """
+@tracing.traced
 def has_correct_syntax(expr):
     if has_incorrect_bracket_syntax(expr):
         return False
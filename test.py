@@ -6,10 +6,22 @@ if the programm works correctly.
 import unittest
 
 import util
+import tree
 import brackets as br
 import derive as dev
 import simplify as sim
 import syntax as syn
+import ui
+import batch
+import benchmark
+import tracing
+import registry
+import evaluate as ev
+import context as ctx
+import concurrent.futures as futures
+import tempfile
+import contextlib
+import io
 
 from data import *
 
@@ -28,6 +40,15 @@ class TestsForDerivative(unittest.TestCase):
         ("log{x}*x*3*x^2", "*") : ("log{x}", "x", "3", "x^2")
     }
 
+    # positions of the outer operators with lowest precedence
+    expressions_lowest_precedence_ops = {
+        "a*b+c*d-e" : [3, 7],
+        "x^2*y^3" : [3],
+        "(a+b)*c^2" : [5],
+        "x^2^3" : [1, 3],
+        "sin{x+1}" : []
+    }
+
     # expressions for bracket removal test
     expressions_brackets = {
         "((x))" : "x", 
@@ -46,6 +67,14 @@ class TestsForDerivative(unittest.TestCase):
         "-(a+5-x^2)" : "-a-5+x^2",
         "-(-a+5-x^2)" : "+a-5+x^2",
     }
+
+    # expressions with the argument brackets of functions transformed
+    expressions_transform_brackets = {
+        "sin(x)*cos((x))" : "sin{x}*cos{(x)}",
+        "sinh(x)+(x)" : "sinh{x}+(x)",
+        "sin(x" : "sin(x",
+        "sin(x)+cos(y" : "sin{x}+cos(y",
+    }
         
     # expressions for simplification test
     expressions_simplify = {
@@ -59,7 +88,60 @@ class TestsForDerivative(unittest.TestCase):
         "(2*x^1*sin{x}+x^2*cos{x})" : "2*x*sin{x}+x^2*cos{x}",
         "(0*sin{x}*exp{1*x^0}+cos{x*0}*exp{x^0})" : "e", 
         "0*x^2*sin{x}+3*(2*x^1*sin{x}+x^2*cos{x})" : "3*(2*x*sin{x}+x^2*cos{x})",
-        "0*x^2*x^3+3*(2*x^1*x^3+x^2*3*x^2)+0*x^2*sin{x}+3*(2*x^1*sin{x}+x^2*cos{x})" : "3*(2*x^4+3*x^4)+3*(2*x*sin{x}+x^2*cos{x})"
+        "0*x^2*x^3+3*(2*x^1*x^3+x^2*3*x^2)+0*x^2*sin{x}+3*(2*x^1*sin{x}+x^2*cos{x})" : "15*x^4+3*(2*x*sin{x}+x^2*cos{x})",
+        "2*x+3*x" : "5*x",
+        "x*sin{x}-3*sin{x}*x+2*x^2+5-x^2" : "x^2+5-2*x*sin{x}",
+        "0.5*x+0.5*x-x" : "0",
+        "y*x*a" : "a*x*y",
+        "(a+b)*x+(b+a)*x" : "2*x*(a+b)",
+        "(a+b)*(b+a)" : "(a+b)^2"
+    }
+
+    # pairs of expressions with equal (True) 
+    # or different (False) structural hashes
+    expressions_structural_hash = {
+        ("a+b", "b+a") : True,
+        ("(a+b)+c", "a+(b+c)") : True,
+        ("a*b*c", "c*(b*a)") : True,
+        ("a-(b-c)", "c+a-b") : True,
+        ("sin{a*b}", "sin{b*a}") : True,
+        ("a-b", "b-a") : False,
+        ("a^b", "b^a") : False,
+        ("a*(b+c)", "a*b+c") : False
+    }
+
+    # expressions compiled and evaluated with the values of their arguments
+    expressions_evaluate = {
+        "2*x+1" : ({"x" : 3}, 7),
+        "x^(-1)" : ({"x" : 4}, 0.25),
+        "-x^2" : ({"x" : 3}, -9),
+        "sin(x)^2+cos(x)^2" : ({"x" : 0.7}, 1),
+        "exp{log{x}}*y" : ({"x" : 2.5, "y" : 2}, 5),
+        "0.5*x^(-0.5)+tanh(0)" : ({"x" : 4}, 0.25),
+        "e^x-exp(x)+pi" : ({"x" : 1.5}, 3.141592653589793),
+        "x^-2*y" : ({"x" : 2, "y" : 2}, 0.5),
+    }
+
+    # expressions that cannot be evaluated at x = -4 with the math module
+    expressions_domain = ["x^0.5", "log{x^0.5}", "sqrt{x}", "(x+1)^1.5"]
+
+    # constant subtrees folded to floats
+    expressions_folding = {
+        "3*2^(-1)+x" : "x+1.5",
+        "sin{1+1}+2*sin{2}" : "2.727892280477045",
+        "e*x" : "2.718281828459045*x",
+        "log{-1}+0^(-1)" : "log{-1}+0^(-1)",
+        "sin{0}*y" : "0",
+        "y*x^(-1)" : "x^(-1)*y",
+        "(x+1)*(x-2)^(-1)" : "(x+1)*(x-2)^(-1)",
+        "-2*x^(-3)*2^(-1)" : "-x^(-3)",
+        "sin{-1}+2-5" : "-3.8414709848078967",
+    }
+
+    # derivatives with quotients, constants folded to floats
+    expressions_folding_derivatives = {
+        "x^sin{x}" : "x^sin(x)*(log(x)*cos(x)+x^(-1)*sin(x))",
+        "(x+1)*(x-2)^(-1)" : "(x-2)^(-1)-(x-2)^(-2)*(x+1)",
     }
 
     # derivatves tested with their solutions
@@ -73,6 +155,127 @@ class TestsForDerivative(unittest.TestCase):
         "3*x^2*x^3+3*x^2*sin{x}" : "(0)*(x^2*x^3)+(3)*((2*x^(1))*(x^3)+(x^2)*(3*x^(2)))+(0)*(x^2*sin{x})+(3)*((2*x^(1))*(sin{x})+(x^2)*(cos{x}))",
         "3*x^2*(x^3+sin{x})" : "(0)*(x^2*(x^3+sin{x}))+(3)*((2*x^(1))*((x^3+sin{x}))+(x^2)*(3*x^(2)+cos{x}))" 
     }
+
+    # expressions with divisions and signs after operators
+    expressions_syntax = {
+        "x/(1+x)/2" : "x*((1+x))^(-1)*(2)^(-1)",
+        "(a/b)+c" : "(a*(b)^(-1))+c",
+        "sin(x/2)*3" : "sin(x*(2)^(-1))*3",
+        "x/-y" : "x*(-y)^(-1)",
+        "a/(b+c)^2" : "a*((b+c)^2)^(-1)",
+        "x*-(a*-b)" : "x*(-(a*(-b)))",
+        "a*-b^-c" : "a*(-b^(-c))",
+        "x*-1^2" : "x*(-1^2)",
+    }
+
+    # expressions parsed to a tree and written back as string
+    expressions_tree = {
+        "(a+b)+(c*d)+(e*f)*(g+h)" : "a+b+c*d+e*f*(g+h)",
+        "sin(x*(x^2)+exp{x})" : "sin{x*x^2+exp{x}}",
+        "(x^2)^3" : "(x^2)^3",
+        "x^2^3" : "x^2^3",
+        "a-(b-c)" : "a-(b-c)",
+        "(-1)*sin{x}" : "(-1)*sin{x}",
+        "x^(-1)" : "x^(-1)",
+        "x^-2*y" : "x^(-2)*y",
+        "a*-b*c" : "a*(-b)*c",
+        "x^-2^3" : "x^(-2^3)",
+        "-x*y" : "-x*y",
+        "d{f(x), x}" : "d{f{x}, x}"
+    }
+
+    # derivatives for the argument t with the functions sin and f,
+    # where sin is derived to cos and f to 2*ARG
+    expressions_context = {
+        "sin{t}*x+f{t^2}+exp{t}" : "x*cos(t)+4*t^3+d(exp(t), t)",
+        "sin{f{t}}" : "2*t*cos(f(t))",
+        "sin{x}*t" : "sin(x)",
+    }
+
+    # invalid derivatives of a function
+    templates_invalid = ["2*ARG+", "y*ARG", "", None]
+
+    # partial derivatives of x1^2*sin{alpha}+exp{x1*y}+y
+    expressions_gradient = {
+        "x1" : "2*x1*sin(alpha)+y*exp(x1*y)",
+        "alpha" : "x1^2*cos(alpha)",
+        "y" : "x1*exp(x1*y)+1",
+        "z" : "0"
+    }
+
+    # gradients for x and y of expressions with unknown 
+    # functions, the same in forward and in reverse mode
+    expressions_gradient_unknown = {
+        "f{x^2}" : {"x" : "d(f(x^2), x)", "y" : "0"},
+        "sin{x}*f{x^2}+g{x*y}" : {"x" : "cos(x)*f(x^2)+sin(x)*d(f(x^2), x)+d(g(x*y), x)", "y" : "d(g(x*y), y)"},
+    }
+
+    # values and derivatives in forward mode 
+    # for x = 1 and the constant a = 3
+    expressions_forward = {
+        "x^x" : (1.0, 1.0),
+        "a^2" : (9.0, 0.0),
+        "a*x+sin{0}" : (3.0, 3.0),
+    }
+
+    # expressions of size 3 of the benchmark families
+    expressions_benchmark = {
+        "long_sum" : "1*exp{x}^1+2*log{x}^2+3*sqrt{x}^3",
+        "nested_product" : "(x+2)*((x+1)*(x))",
+        "function_chain" : "sqrt{log{exp{x}}}",
+        "power_tower" : "x^(x^(x))",
+    }
+
+    # calls of traced functions for one derivation
+    calls_traced = {
+        "ui.derive_ui" : 1,
+        "tree.parse" : 1,
+        "derive.derive_tree" : 1,
+        "simplify.simplify_tree" : 2,
+    }
+
+    # derivatives with the registered functions asin and sq
+    expressions_registry = {
+        "sq{x}" : "2*x",
+        "asin{2*x}" : "2*(1-(2*x)^2)^(-0.5)",
+        "sq{asin{x}}+asin{0}" : "2*asin(x)*(1-x^2)^(-0.5)",
+    }
+
+    # invalid known values of a registered function
+    values_invalid = [{"0" : "0+"}, {"0+" : "0"}, {"0" : None}]
+
+    # pairs of expressions whose derivatives share
+    # an entry of the persistent cache
+    expressions_disk_cache = {
+        "x^2*sin{x}" : "sin{x}*x^2",
+        "exp{x}+x*log{x}" : "log{x}*x+exp{x}",
+    }
+
+    # lines of the batch mode with the derivative and the id of
+    # their result, no derivative for lines with an error
+    expressions_batch = {
+        "x^2\n" : ("2*x", None),
+        '{"expr": "sin(x)", "id": 3}\n' : ("cos(x)", 3),
+        "x+*2\n" : (None, None),
+        '{"id": 4}\n' : (None, None),
+    }
+
+    # invalid arguments of the batch mode and their error messages
+    arguments_batch_invalid = {
+        ("-j", "-1") : "the number of jobs must not be negative",
+        ("--chunk-size", "0") : "the chunk size must be at least 1",
+    }
+
+    # derivatives of the tree based methods, simplified
+    expressions_derivatives_tree = {
+        "sin{cos{exp{x^2}}}" : "-2*x*exp{x^2}*sin{exp{x^2}}*cos{cos{exp{x^2}}}",
+        "5*x" : "5",
+        "x^2" : "2*x",
+        "tanh{x}" : "1-tanh{x}^2",
+        "x^x" : "x^x*(log{x}+1)",
+        "3*x^2*(x^3+sin{x})" : "6*x*(x^3+sin{x})+3*x^2*(3*x^2+cos{x})",
+        "f{x}" : "d{f{x}, x}"
+    }
     
     
     # tests for operator splitting
@@ -86,6 +289,14 @@ class TestsForDerivative(unittest.TestCase):
                 self.assertEqual(parts, sol)
             
     
+    # tests for the lowest precedence operators of an expression
+    def test_lowest_precedence_ops(self):
+        for expr in self.expressions_lowest_precedence_ops:
+            sol = self.expressions_lowest_precedence_ops.get(expr)
+            with self.subTest():
+                self.assertEqual(util.get_pos_of_lowest_precedence_ops(expr), sol)
+            
+    
     # tests for bracket removal
     def test_brackets(self):
         for expr in self.expressions_brackets:
@@ -93,6 +304,14 @@ class TestsForDerivative(unittest.TestCase):
             expr = br.remove_brackets(expr)
             with self.subTest():
                 self.assertEqual(expr, sol)
+
+    
+    # tests for the transformation of function brackets
+    def test_transform_brackets(self):
+        for expr in self.expressions_transform_brackets:
+            sol = self.expressions_transform_brackets.get(expr)
+            with self.subTest():
+                self.assertEqual(br.transform_brackets(expr), sol)
    
     
     # tests for expression simplification
@@ -105,6 +324,40 @@ class TestsForDerivative(unittest.TestCase):
                 self.assertEqual(expr, sol)
     
     
+    # tests for the statistics of the worklist simplification
+    def test_simplification_stats(self):
+        node = tree.parse("x^(-1)*1*x+5+3*(2*x^1*x^3)")
+        ctx.get_context(None).simplify_cache.clear()
+        stats = {}
+        sim.simplify_tree(node, stats)
+        with self.subTest():
+            self.assertGreater(stats.get("rewrites"), 0)
+        with self.subTest():
+            self.assertGreaterEqual(stats.get("passes"), stats.get("rewrites"))
+        # simplified subtrees are not simplified again
+        stats = {}
+        sim.simplify_tree(node, stats)
+        with self.subTest():
+            self.assertEqual(stats, {"passes" : 0, "rewrites" : 0})
+
+
+    # tests for rewrites that lead back to an earlier tree
+    def test_simplification_cycle(self):
+        rewrite_tree = sim.rewrite_tree
+        # swaps the operands of every sum, so a+b -> b+a -> a+b
+        def rewrite_swap(node, context=None):
+            if type(node) == tree.Binary and node.op == "+":
+                return tree.Binary("+", node.right, node.left)
+            return node
+        sim.rewrite_tree = rewrite_swap
+        try:
+            node = sim.simplify_tree(tree.parse("a+b"), context=ctx.Context())
+        finally:
+            sim.rewrite_tree = rewrite_tree
+        with self.subTest():
+            self.assertIn(tree.to_string(node), ["a+b", "b+a"])
+
+
     # tests for derivative
     def test_derivative(self):
         for expr in self.expressions_derivatives:
@@ -112,6 +365,435 @@ class TestsForDerivative(unittest.TestCase):
             expr = dev.derive_sub(expr)
             with self.subTest():
                 self.assertEqual(expr, sol)
+    
+    
+    # tests for the modification of the syntax of the input
+    def test_syntax(self):
+        for expr in self.expressions_syntax:
+            sol = self.expressions_syntax.get(expr)
+            with self.subTest():
+                self.assertEqual(syn.modify_input(expr), sol)
+
+
+    # tests for parsing and printing of expression trees
+    def test_tree(self):
+        for expr in self.expressions_tree:
+            sol = self.expressions_tree.get(expr)
+            expr = tree.to_string(tree.parse(expr))
+            with self.subTest():
+                self.assertEqual(expr, sol)
+    
+    
+    # tests for structural hashes of expression trees
+    def test_structural_hash(self):
+        for exprs in self.expressions_structural_hash:
+            sol = self.expressions_structural_hash.get(exprs)
+            hashes = [tree.structural_hash(tree.parse(expr)) for expr in exprs]
+            with self.subTest():
+                self.assertEqual(hashes[0] == hashes[1], sol)
+
+
+    # tests for shared subtrees of expression trees
+    def test_tree_sharing(self):
+        node = tree.parse("sin{x^2}*x+sin{x^2}")
+        with self.subTest():
+            self.assertIs(node.left.left, node.right)
+        with self.subTest():
+            self.assertIs(node.right, tree.parse("sin(x^2)"))
+        with self.subTest():
+            self.assertEqual(tree.count_nodes(node), 6)
+        # derivatives share the subtrees of the derived expression
+        node = dev.derive_tree(tree.parse("sin{x}*cos{x}*exp{x}"))
+        with self.subTest():
+            self.assertLess(tree.count_nodes(node), len(tree.to_string(node)))
+    
+    
+    # tests for bracket removal of expression trees
+    def test_brackets_tree(self):
+        for expr in self.expressions_brackets:
+            sol = self.expressions_brackets.get(expr)
+            expr = tree.to_string(br.remove_brackets_tree(tree.parse(expr)))
+            with self.subTest():
+                self.assertEqual(expr, sol)
+    
+    
+    # tests for the cache of derivatives of subexpressions
+    def test_derive_cache(self):
+        expr = "sin{x^2}*cos{x^2}*exp{x^2}"
+        ctx.get_context(None).derive_cache.clear()
+        sol = dev.derive_sub(expr)
+        misses = ctx.get_context(None).derive_cache.misses
+        with self.subTest():
+            self.assertGreater(ctx.get_context(None).derive_cache.hits, 0)
+        with self.subTest():
+            self.assertEqual(dev.derive_sub(expr), sol)
+        with self.subTest():
+            self.assertEqual(ctx.get_context(None).derive_cache.misses, misses)
+        dev.set_derive_cache_size(2)
+        with self.subTest():
+            self.assertEqual(ctx.get_context(None).derive_cache.info().get("size"), 2)
+        dev.set_derive_cache_size(DERIVE_CACHE_SIZE)
+    
+    
+    # tests for derivative of expression trees
+    def test_derivative_tree(self):
+        for expr in self.expressions_derivatives_tree:
+            sol = self.expressions_derivatives_tree.get(expr)
+            node = dev.derive_tree(tree.parse(expr))
+            node = sim.simplify_tree(br.remove_brackets_tree(node))
+            expr = tree.to_string(node)
+            with self.subTest():
+                self.assertEqual(expr, sol)
+
+
+    # tests for the settings of a derivation
+    def test_context(self):
+        context = ctx.Context(arg="t", functions={"sin" : "cos", "f" : "2*ARG"})
+        for expr in self.expressions_context:
+            sol = self.expressions_context.get(expr)
+            with self.subTest():
+                self.assertEqual(ui.derive_ui(expr, context=context), sol)
+        with self.subTest():
+            with self.assertRaises(AttributeError):
+                context.arg = "x"
+        # invalid derivatives are found when the context is created
+        for template in self.templates_invalid:
+            with self.subTest():
+                self.assertRaises(ValueError, ctx.Context, functions={"f" : template})
+        template = ctx.DevTemplate("f", "ARG*sin{ARG}^2+1")
+        with self.subTest():
+            self.assertIs(template.build_tree(tree.parse("a+b")), tree.parse("(a+b)*sin{a+b}^2+1"))
+        with self.subTest():
+            self.assertEqual(template.build_string("a+b"), "(a+b)*sin{(a+b)}^2+1")
+        # checking the syntax must not change the operators of data.py
+        operators = dict(OPERATORS_DICT)
+        with self.subTest():
+            self.assertTrue(syn.has_correct_syntax("a/b"))
+        with self.subTest():
+            self.assertEqual(OPERATORS_DICT, operators)
+        # one context shared by several threads
+        context = ctx.Context()
+        exprs = ["sin{x^%d}*exp{x}+x^%d" % (n, n) for n in range(40)]
+        sols = [ui.derive_ui(expr, context=ctx.Context()) for expr in exprs]
+        with futures.ThreadPoolExecutor(8) as pool:
+            with self.subTest():
+                self.assertEqual(list(pool.map(lambda expr: ui.derive_ui(expr, context=context), exprs)), sols)
+
+
+    # tests for the batch mode
+    def test_batch(self):
+        lines = list(self.expressions_batch)
+        # empty lines have no result
+        records = list(batch.derive_batch(lines[:1] + ["\n"] + lines[1:]))
+        with self.subTest():
+            self.assertEqual(len(records), len(lines))
+        for line, record in zip(lines, records):
+            sol = self.expressions_batch.get(line)
+            with self.subTest():
+                self.assertEqual((record.get("derivative"), record.get("id")), sol)
+            with self.subTest():
+                self.assertEqual(record.get("error") is None, sol[0] is not None)
+        with self.subTest():
+            self.assertIn("derive", records[0]["timings"])
+        # several processes give the same results
+        lines = ["x^%d\n" % n for n in range(2, 12)]
+        records = list(batch.derive_parallel(lines, workers=2, chunk_size=3))
+        with self.subTest():
+            self.assertEqual([r["derivative"] for r in records], 
+                             [r["derivative"] for r in batch.derive_batch(lines)])
+        records = batch.derive_parallel(lines, workers=2, chunk_size=3, ordered=False)
+        with self.subTest():
+            self.assertEqual(sorted(r["index"] for r in records), list(range(10)))
+        # chunks must not be empty, otherwise all lines would be buffered
+        with self.subTest():
+            self.assertRaises(ValueError, next, batch.iter_chunks(lines, 0))
+        # a negative number of jobs and empty chunks are rejected
+        for argv in self.arguments_batch_invalid:
+            err = io.StringIO()
+            with self.subTest():
+                with contextlib.redirect_stderr(err), self.assertRaises(SystemExit):
+                    batch.main(list(argv))
+            with self.subTest():
+                self.assertIn(self.arguments_batch_invalid.get(argv), err.getvalue())
+
+
+    # tests for compiled expressions
+    def test_evaluate(self):
+        for expr in self.expressions_evaluate:
+            args, sol = self.expressions_evaluate.get(expr)
+            compiled = ev.compile_expr(expr, tuple(args), backend="math")
+            with self.subTest():
+                self.assertAlmostEqual(compiled(*args.values()), sol)
+        # compiled functions are cached
+        with self.subTest():
+            self.assertIs(ev.compile_expr("x^2"), ev.compile_expr("x^2"))
+        # unknown symbols and numbers that are too large for a float
+        for expr in ["x*y", "x+" + "9"*400]:
+            with self.subTest():
+                self.assertRaises(ValueError, ev.compile_expr, expr)
+        # negative bases with fractional exponents give no complex numbers
+        for expr in self.expressions_domain:
+            with self.subTest(expr=expr):
+                self.assertRaises(ValueError, ev.compile_expr(expr, backend="math"), -4.0)
+            with self.subTest(expr=expr):
+                self.assertRaises(ValueError, ev.derive_forward, expr, -4.0, backend="math")
+            with self.subTest(expr=expr):
+                self.assertRaises(ValueError, ev.gradient_reverse, expr, {"x" : -4.0}, backend="math")
+
+
+    # tests for compiled expressions evaluated for arrays
+    @unittest.skipUnless(ev.numpy, "NumPy is not installed")
+    def test_evaluate_array(self):
+        x = ev.numpy.array([1, 2, 4])
+        for expr in self.expressions_evaluate:
+            args, _ = self.expressions_evaluate.get(expr)
+            compiled_math = ev.compile_expr(expr, tuple(args), backend="math")
+            compiled = ev.compile_expr(expr, tuple(args), backend="numpy")
+            values = compiled(*[x * value for value in args.values()])
+            for i in range(len(x)):
+                with self.subTest(expr=expr, i=i):
+                    self.assertAlmostEqual(values[i], compiled_math(*[int(x[i]) * value for value in args.values()]))
+
+
+    # tests for forward-mode derivatives
+    def test_derive_forward(self):
+        context = ctx.Context()
+        for expr in self.expressions_derivatives:
+            derivative = ev.compile_expr(ui.derive_ui(expr, context=context), backend="math")
+            value, dot = ev.derive_forward(expr, 0.7, backend="math")
+            with self.subTest():
+                self.assertAlmostEqual(value, ev.compile_expr(expr, backend="math")(0.7))
+            with self.subTest():
+                self.assertAlmostEqual(dot, derivative(0.7))
+        for expr in self.expressions_forward:
+            sol = self.expressions_forward.get(expr)
+            with self.subTest():
+                self.assertEqual(ev.derive_forward(expr, 1.0, constants={"a" : 3}, backend="math"), sol)
+
+
+    # tests for forward-mode derivatives of arrays
+    @unittest.skipUnless(ev.numpy, "NumPy is not installed")
+    def test_derive_forward_array(self):
+        x = ev.numpy.array([0.3, 0.7, 1.5])
+        for expr in self.expressions_derivatives:
+            values, dots = ev.derive_forward(expr, x, backend="numpy")
+            for i in range(len(x)):
+                value, dot = ev.derive_forward(expr, float(x[i]), backend="math")
+                with self.subTest(expr=expr, i=i):
+                    self.assertAlmostEqual(values[i], value)
+                with self.subTest(expr=expr, i=i):
+                    self.assertAlmostEqual(dots[i], dot)
+        # constant expressions have zero derivatives in the shape of 'x'
+        self.assertEqual(ev.derive_forward("2^3", x, backend="numpy")[1].shape, x.shape)
+
+
+    # tests for gradients of several variables
+    def test_gradient(self):
+        context = ctx.Context()
+        gradient = ui.gradient_ui("x1^2*sin{alpha}+exp{x1*y}+y", list(self.expressions_gradient), context=context)
+        for arg in self.expressions_gradient:
+            sol = self.expressions_gradient.get(arg)
+            with self.subTest():
+                self.assertEqual(gradient.get(arg), sol)
+        # symbolic gradients in both modes and numeric gradients agree
+        expr = "x1^2*sin{alpha}+exp{x1*y}+y+x1^y-y*tan{x1}"
+        values = {"x1" : 1.2, "alpha" : 0.3, "y" : 0.7, "z" : 2.0}
+        gradient = ui.gradient_ui(expr, values, context=context)
+        with self.subTest():
+            self.assertEqual(ui.gradient_ui(expr, values, context=context, reverse=True), gradient)
+        value, gradient_values = ev.gradient_reverse(expr, values, backend="math")
+        with self.subTest():
+            self.assertAlmostEqual(value, ev.compile_expr(expr, values, backend="math")(*values.values()))
+        for arg in values:
+            compiled = ev.compile_expr(gradient.get(arg), values, backend="math")
+            with self.subTest():
+                self.assertAlmostEqual(gradient_values.get(arg), compiled(*values.values()))
+        for expr in self.expressions_gradient_unknown:
+            sol = self.expressions_gradient_unknown.get(expr)
+            for reverse in [False, True]:
+                with self.subTest(expr=expr, reverse=reverse):
+                    self.assertEqual(ui.gradient_ui(expr, ["x", "y"], context=context, reverse=reverse), sol)
+        # variables are only found as whole names
+        with self.subTest():
+            self.assertFalse(dev.is_arg_in_expr("exp{x1}+xy"))
+        with self.subTest():
+            self.assertTrue(dev.is_arg_in_expr("exp{x1}+xy", arg="x1"))
+
+
+    # tests for reverse-mode gradients of arrays
+    @unittest.skipUnless(ev.numpy, "NumPy is not installed")
+    def test_gradient_array(self):
+        values = {"x" : ev.numpy.array([0.5, 1.5]), "y" : ev.numpy.array([2.0, 3.0])}
+        value, gradient = ev.gradient_reverse("5*x+x*y^2", values, backend="numpy")
+        for i in range(2):
+            x, y = float(values.get("x")[i]), float(values.get("y")[i])
+            with self.subTest(i=i):
+                self.assertAlmostEqual(value[i], 5*x+x*y**2)
+            with self.subTest(i=i):
+                self.assertAlmostEqual(gradient.get("x")[i], 5+y**2)
+            with self.subTest(i=i):
+                self.assertAlmostEqual(gradient.get("y")[i], 2*x*y)
+
+
+    # tests for the benchmarks of the derivation
+    def test_benchmark(self):
+        context = ctx.Context()
+        for family in self.expressions_benchmark:
+            sol = self.expressions_benchmark.get(family)
+            expr = benchmark.FAMILIES.get(family)(3)
+            with self.subTest():
+                self.assertEqual(expr, sol)
+            with self.subTest():
+                self.assertTrue(syn.has_correct_syntax(expr))
+            with self.subTest():
+                self.assertNotEqual(ui.derive_ui(expr, context=context), "0")
+        results = benchmark.run_benchmarks(["long_sum"], [1, 3], repeats=2)
+        timings = results["families"]["long_sum"]["3"]
+        with self.subTest():
+            self.assertEqual(set(timings), {name for name, label, stage in ui.DERIVE_STAGES} | {"to_string", "total"})
+        # the stages of the fastest repetition add up to its total
+        with self.subTest():
+            self.assertAlmostEqual(sum(timings.get(stage) for stage in timings if stage != "total"), timings.get("total"))
+
+
+    # tests for the tracing of calls and events
+    def test_tracing(self):
+        context = ctx.Context()
+        tracing.reset()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            ui.derive_ui("x^2*sin{x}")
+            ui.derive_ui("x^2*sin{x}", context=context)
+        with self.subTest():
+            self.assertEqual(tracing.get_report(), {"functions" : {}, "events" : []})
+        # the stages are only printed by the program, not by the library
+        with self.subTest():
+            self.assertEqual(out.getvalue(), "")
+        tracing.enable()
+        try:
+            ui.derive_ui("x^3*sin{x}", context=context)
+        finally:
+            tracing.disable()
+        report = tracing.get_report()
+        for name in self.calls_traced:
+            sol = self.calls_traced.get(name)
+            with self.subTest():
+                self.assertEqual(report["functions"][name]["calls"], sol)
+        with self.subTest():
+            self.assertIn("Parsed:\t\t\tx^3*sin{x}", [event["message"] for event in report["events"]])
+        # arguments are recorded as they are at the time of the event
+        tracing.reset()
+        parts = ["a"]
+        tracing.enable()
+        try:
+            tracing.event("test", "%s %s", parts, "x"*(2*TRACE_MAX_ARG_LENGTH))
+        finally:
+            tracing.disable()
+        parts.append("b")
+        message = tracing.get_report()["events"][0]["message"]
+        with self.subTest():
+            self.assertTrue(message.startswith("['a'] x"))
+        with self.subTest():
+            self.assertLess(len(message), 2*TRACE_MAX_ARG_LENGTH)
+        tracing.reset()
+
+
+    # tests for the registry of elementary functions
+    def test_registry(self):
+        functions = registry.FunctionRegistry()
+        functions.register("asin", "(1+(-1)*ARG^2)^(-0.5)", values={"0" : "0"})
+        functions.register("sq", "2*ARG", implementations={"math" : lambda value: value*value})
+        context = functions.get_context()
+        for expr in self.expressions_registry:
+            sol = self.expressions_registry.get(expr)
+            with self.subTest():
+                self.assertEqual(ui.derive_ui(expr, context=context), sol)
+        compiled = ev.compile_expr("sq{x}+asin{x}", context=context, backend="math")
+        with self.subTest():
+            self.assertAlmostEqual(compiled(0.5), 0.25+0.5235987755982989)
+        with self.subTest():
+            self.assertIs(functions.get_context(), functions.get_context())
+        functions.unregister("sq")
+        with self.subTest():
+            self.assertNotIn("sq", functions.get_context().functions)
+        # invalid functions are not registered
+        with self.subTest():
+            self.assertRaises(ValueError, functions.register, "bad", "ARG+")
+        for values in self.values_invalid:
+            with self.subTest():
+                self.assertRaises(ValueError, functions.register, "asin", "ARG", values=values)
+        # functions of the registry of the program are known by the batch mode 
+        # and by the contexts of the registry, the default context is not changed
+        context = registry.register_function("asin", "(1+(-1)*ARG^2)^(-0.5)", values={"0" : "0"})
+        try:
+            with self.subTest():
+                self.assertEqual(batch.derive_record("asin(x^2)").get("derivative"), "2*x*(1-(x^2)^2)^(-0.5)")
+            with self.subTest():
+                self.assertEqual(br.transform_brackets("asin(x)", context), "asin{x}")
+            with self.subTest():
+                self.assertEqual(dev.derive_sub("asin{x}", context), "((1+(-1)*(x)^2)^(-0.5))*(1)")
+            with self.subTest():
+                self.assertNotIn("asin", ctx.get_context(None).functions)
+        finally:
+            context = registry.unregister_function("asin")
+        with self.subTest():
+            self.assertNotIn("asin", context.functions)
+
+
+    # tests for the folding of constant subtrees
+    def test_constant_folding(self):
+        context = ctx.Context(fold_policy=FOLD_FLOAT)
+        for expr in self.expressions_folding:
+            sol = self.expressions_folding.get(expr)
+            expr = tree.to_string(sim.simplify_tree(tree.parse(expr), context=context))
+            with self.subTest():
+                self.assertEqual(expr, sol)
+        for expr in self.expressions_folding_derivatives:
+            sol = self.expressions_folding_derivatives.get(expr)
+            with self.subTest():
+                self.assertEqual(ui.derive_ui(expr, context=context), sol)
+        # exact values only by default
+        with self.subTest():
+            self.assertEqual(sim.simplify("3*sin{2}+exp{0}"), "3*sin{2}+1")
+        with self.subTest():
+            self.assertRaises(ValueError, ctx.Context, fold_policy="fast")
+
+
+    # tests for the persistent cache of derivatives
+    def test_persistent_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for expr in self.expressions_disk_cache:
+                expr_reordered = self.expressions_disk_cache.get(expr)
+                context = ctx.Context(cache_dir=cache_dir)
+                derivative = ui.derive_ui(expr, context=context)
+                context.disk_cache.close()
+                # a new run finds the derivative, also for reordered factors
+                context = ctx.Context(cache_dir=cache_dir)
+                timings = {}
+                with self.subTest():
+                    self.assertEqual(ui.derive_ui(expr_reordered, timings, context), derivative)
+                with self.subTest():
+                    self.assertNotIn("derive", timings)
+                with self.subTest():
+                    self.assertEqual(context.disk_cache.info()["hits"], 1)
+                context.disk_cache.close()
+            # other settings do not share entries
+            other = ctx.Context(arg="y", cache_dir=cache_dir)
+            with self.subTest():
+                self.assertEqual(ui.derive_ui("x^2*sin{x}", context=other), "0")
+            other.disk_cache.resize(1)
+            with self.subTest():
+                self.assertEqual(other.disk_cache.info()["size"], 1)
+            other.disk_cache.close()
+            # the caches of a registry are closed when its functions change
+            functions = registry.FunctionRegistry()
+            context = functions.get_context(cache_dir=cache_dir)
+            ui.derive_ui("x^3", context=context)
+            functions.register("sq", "2*ARG")
+            with self.subTest():
+                self.assertIsNone(context.disk_cache.connection)
+            with self.subTest():
+                self.assertIsNot(functions.get_context(cache_dir=cache_dir), context)
             
 
 
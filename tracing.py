@@ -0,0 +1,219 @@
+# coding: utf8
+"""
+Tracing and metrics of the program. Functions marked with
+'traced' count their calls and the seconds spent in them,
+and 'event(..)' records messages whose arguments are written as
+short strings, so events do not keep whole expression trees or
+lists that change later. Tracing is off by default and can be
+turned on and off while the program runs, when it is off a
+traced function only checks a flag before it is called.
+"""
+import time
+import json
+import functools
+import threading
+import collections
+
+from data import *
+
+
+
+"""
+Collects the calls, timers and events while tracing is on.
+"""
+class Tracer(object):
+
+    """
+    @param max_events   int, maximum number of kept events,
+                        older events are dropped
+    """
+    def __init__(self, max_events=TRACE_MAX_EVENTS):
+        self.enabled = False
+        self.lock = threading.Lock()
+        # (number of calls, seconds) per function
+        self.timers = collections.defaultdict(lambda: [0, 0.0])
+        # (seconds since start, name, format string, arguments as strings)
+        self.events = collections.deque(maxlen=max_events)
+        self.time_start = time.perf_counter()
+
+    """
+    Adds a call of 'name' that took 'seconds'.
+
+    @param name     string, name of the function
+    @param seconds  float, duration of the call
+    """
+    def add_call(self, name, seconds):
+        with self.lock:
+            timer = self.timers[name]
+            timer[0] += 1
+            timer[1] += seconds
+
+    """
+    Records an event whose message is 'string % args'. The arguments
+    are converted to strings now, the message is put together when
+    the report is written.
+
+    @param name     string, kind of the event
+    @param string   string, format string of the message
+    @param args     arguments of the format string
+    """
+    def add_event(self, name, string, args):
+        args = tuple(snapshot_arg(arg) for arg in args)
+        with self.lock:
+            self.events.append((time.perf_counter() - self.time_start, name, string, args))
+
+    """
+    Removes all calls, timers and events.
+    """
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.events.clear()
+            self.time_start = time.perf_counter()
+
+    """
+    @return     dict, profile with the keys "functions", the calls
+                and seconds per function sorted by their seconds,
+                and "events", the formatted events
+    """
+    def get_report(self):
+        with self.lock:
+            timers = sorted(self.timers.items(), key=lambda item: item[1][1], reverse=True)
+            events = list(self.events)
+        return {
+            "functions" : {name : {"calls" : calls, "seconds" : seconds} for name, (calls, seconds) in timers},
+            "events" : [{"time" : time_event, "name" : name, "message" : format_message(string, args)}
+                        for time_event, name, string, args in events]
+        }
+
+
+# tracer of the program
+TRACER = Tracer()
+
+
+"""
+Converts an argument of an event to a string that is not
+longer than 'TRACE_MAX_ARG_LENGTH'. Expression trees are
+written as expressions.
+
+@param arg      argument of the format string of an event
+
+@return         string, argument as it is at the time of the event
+"""
+def snapshot_arg(arg):
+    string = str(arg)
+    if len(string) > TRACE_MAX_ARG_LENGTH:
+        string = string[:TRACE_MAX_ARG_LENGTH] + "..."
+    return string
+
+
+"""
+Formats the message of an event.
+
+@param string   string, format string of the message
+@param args     tuple, arguments of the format string
+
+@return         string, message
+"""
+def format_message(string, args):
+    if not args:
+        return str(string)
+    return string % args
+
+
+"""
+Turns tracing on.
+"""
+def enable():
+    TRACER.enabled = True
+
+
+"""
+Turns tracing off, the collected data is kept.
+"""
+def disable():
+    TRACER.enabled = False
+
+
+"""
+@return     boolean, True if tracing is on
+"""
+def is_enabled():
+    return TRACER.enabled
+
+
+"""
+Removes all collected data.
+"""
+def reset():
+    TRACER.reset()
+
+
+"""
+Records an event while tracing is on. Nothing is
+formatted if tracing is off.
+
+@param name     string, kind of the event
+@param string   string, format string of the message
+@param args     arguments of the format string
+"""
+def event(name, string, *args):
+    if TRACER.enabled:
+        TRACER.add_event(name, string, args)
+
+
+"""
+Decorator that counts the calls of 'func' and the seconds
+spent in it while tracing is on.
+
+@param func     function to be traced
+
+@return         function, traced version of 'func'
+"""
+def traced(func):
+    name = func.__module__ + "." + func.__qualname__
+
+    @functools.wraps(func)
+    def traced_func(*args, **kwargs):
+        if not TRACER.enabled:
+            return func(*args, **kwargs)
+        time_i = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            TRACER.add_call(name, time.perf_counter() - time_i)
+    return traced_func
+
+
+"""
+@return     dict, profile of the collected data,
+            see 'Tracer.get_report(..)'
+"""
+def get_report():
+    return TRACER.get_report()
+
+
+"""
+Writes the profile of the collected data as a table to 'out',
+the functions with the most seconds first.
+
+@param out      file, stream the table is written to
+"""
+def print_report(out):
+    report = get_report()
+    functions = report.get("functions")
+    out.write("%-40s %10s %12s %12s" % ("function", "calls", "seconds", "per call") + NEWLINE)
+    for name in functions:
+        calls = functions.get(name).get("calls")
+        seconds = functions.get(name).get("seconds")
+        out.write("%-40s %10d %12.6f %12.9f" % (name, calls, seconds, seconds / calls) + NEWLINE)
+
+
+"""
+Saves the profile of the collected data as JSON.
+
+@param path     string, path of the file
+"""
+def save_report(path):
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(get_report(), f, indent=2)
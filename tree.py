@@ -0,0 +1,636 @@
+# coding: utf8
+"""
+Tree representation of an expression.
+An expression is tokenized and parsed only once into
+an immutable tree of nodes. All further steps work on
+that tree, strings are only produced again by 'to_string'.
+"""
+import re
+import hashlib
+import weakref
+import threading
+
+import util
+import tracing
+
+from data import *
+
+
+
+# all nodes that exist, with their class and fields as key
+NODES = weakref.WeakValueDictionary()
+# lock for adding nodes to 'NODES', so that two threads
+# never create two different nodes for the same key
+NODES_LOCK = threading.Lock()
+
+
+"""
+Base class of the nodes of an expression tree. Nodes are hash-consed:
+creating a node that is equal to an existing node returns the existing
+node. Equal subtrees are thus stored only once, which makes an expression
+tree a directed acyclic graph (DAG) whose memory use is proportional to
+the number of distinct subexpressions. Since equal nodes are identical, 
+nodes are compared and hashed by their identity in constant time.
+"""
+class Node(object):
+    __slots__ = ("__weakref__",)
+    # names of the fields of a node
+    fields = ()
+
+    def __new__(cls, *values):
+        if len(values) != len(cls.fields):
+            raise TypeError(cls.__name__ + " takes the fields " + ", ".join(cls.fields))
+        key = (cls,) + values
+        if cls == Number:
+            # 1 and 1.0 are equal, but not the same number node
+            key += (type(values[0]),)
+        node = NODES.get(key)
+        if node is None:
+            node = object.__new__(cls)
+            for field, value in zip(cls.fields, values):
+                object.__setattr__(node, field, value)
+            with NODES_LOCK:
+                node = NODES.setdefault(key, node)
+        return node
+
+    def __setattr__(self, name, value):
+        raise AttributeError("nodes of an expression tree cannot be modified")
+
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, field) for field in self.fields))
+
+    def __repr__(self):
+        values = ", ".join(field + "=" + repr(getattr(self, field)) for field in self.fields)
+        return type(self).__name__ + "(" + values + ")"
+
+    def __str__(self):
+        return to_string(self)
+
+
+class Number(Node):
+    __slots__ = ("value",)
+    fields = ("value",)
+
+
+class Symbol(Node):
+    __slots__ = ("name",)
+    fields = ("name",)
+
+
+class Unary(Node):
+    __slots__ = ("op", "operand")
+    fields = ("op", "operand")
+
+
+class Binary(Node):
+    __slots__ = ("op", "left", "right")
+    fields = ("op", "left", "right")
+
+
+class Call(Node):
+    __slots__ = ("func", "args")
+    fields = ("func", "args")
+
+# precedence of nodes that are no operators,
+# i.e. numbers, symbols and function calls
+PRECEDENCE_ATOM = 10
+
+# precedence of signs while parsing, signs bind stronger 
+# than '+' and '-' but weaker than '*', e.g. -x*y = -(x*y)
+PRECEDENCE_SIGN = 0.5
+
+# precedence of signs right after '*' or '^', such a sign only
+# binds the next power, e.g. x^-2*y = x^(-2)*y like in 'modify_input(..)'
+PRECEDENCE_SIGN_OPERAND = 1.5
+
+# regular expression for the tokens of an expression,
+# the order of the groups is the order of the token kinds
+TOKEN_REGEX = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|([A-Za-z_]\w*)|(.))")
+TOKEN_KINDS = ["num", "name", "char"]
+
+
+
+"""
+Splits 'expr' into tokens in one pass. Each token is 
+a pair of its kind ('num', 'name', 'op', 'open', 'close' 
+or 'comma') and its text. The tokens are generated one 
+by one, so that they never have to be stored all at once.
+
+@param expr     string, expression to be tokenized
+
+@return         generator of (string, string) tuples, tokens of 'expr'
+"""
+def iter_tokens(expr):
+    for match in TOKEN_REGEX.finditer(expr):
+        for kind, text in zip(TOKEN_KINDS, match.groups()):
+            if text is None:
+                continue
+            if kind == "char":
+                if text in OPERATORS_DICT:
+                    kind = "op"
+                elif text in BRACKETS:
+                    kind = "open"
+                elif text in BRACKETS_CLOSED:
+                    kind = "close"
+                elif text == ",":
+                    kind = "comma"
+                else:
+                    raise ValueError(ERROR_SYNTAX + expr)
+            yield (kind, text)
+
+
+"""
+Splits 'expr' into a list of tokens, see 'iter_tokens(..)'.
+
+@param expr     string, expression to be tokenized
+
+@return         list of (string, string) tuples, tokens of 'expr'
+"""
+def tokenize(expr):
+    return list(iter_tokens(expr))
+
+
+"""
+Gets the precedence of an operator or a sign on the 
+operator stack of 'parse(..)'.
+
+@param entry    tuple, entry of the operator stack
+
+@return         int or float, precedence of the entry
+"""
+def get_stack_precedence(entry):
+    if entry[0] == "sign":
+        return entry[2]
+    return OPERATORS_DICT.get(entry[1])
+
+
+"""
+Applies the operator or sign 'entry' to the 
+last nodes of the stack 'nodes'.
+
+@param entry    tuple, entry of the operator stack
+@param nodes    node list, stack of parsed nodes
+"""
+def apply_stack_entry(entry, nodes):
+    if entry[0] == "sign":
+        nodes.append(Unary(entry[1], nodes.pop()))
+    else:
+        right = nodes.pop()
+        nodes.append(Binary(entry[1], nodes.pop(), right))
+
+
+"""
+Applies the operators and signs on top of the stack 'ops' 
+that bind stronger than the operator with precedence 
+'precedence' which comes next.
+
+@param ops          tuple list, operator stack
+@param nodes        node list, stack of parsed nodes
+@param precedence   int, precedence of the next operator, 
+                    -1 to apply all operators up to the next bracket
+@param is_right     boolean, True if the next operator is right associative
+"""
+def reduce_stack(ops, nodes, precedence, is_right=False):
+    while ops and ops[-1][0] != "open":
+        precedence_top = get_stack_precedence(ops[-1])
+        if precedence_top < precedence or (precedence_top == precedence and is_right):
+            break
+        apply_stack_entry(ops.pop(), nodes)
+
+
+"""
+Parses 'expr' into an expression tree. Round and curly
+brackets are both accepted, e.g. sin(x) and sin{x}.
+The parser works with an explicit operator stack instead
+of recursion, so that neither long nor deeply nested
+expressions are limited by the recursion depth.
+
+Signs bind stronger than '+' and '-' but weaker than 
+'*' and '^', e.g. -x*y = -(x*y). A sign right after '*' or
+'^' only binds the next power, e.g. x^-2*y = x^(-2)*y.
+
+@param expr     string, expression to be parsed
+
+@return         node, root of the expression tree
+"""
+@tracing.traced
+def parse(expr):
+    nodes = []
+    # entries are ("op", op), ("sign", sign, precedence)
+    # and ("open", bracket, function name or None, number of nodes)
+    ops = []
+    expect_operand = True
+    name = None
+    for kind, text in iter_tokens(expr):
+        # a name is a function if it is followed by a bracket
+        if name is not None:
+            if kind == "open":
+                ops.append(("open", text, name, len(nodes)))
+                name = None
+                continue
+            nodes.append(Symbol(name))
+            name = None
+            expect_operand = False
+        if expect_operand:
+            if kind == "num":
+                nodes.append(Number(util.parse_number(text)))
+                expect_operand = False
+            elif kind == "name":
+                name = text
+            elif kind == "open":
+                ops.append(("open", text, None, len(nodes)))
+            elif kind == "op" and OPERATORS_DICT.get(text) == 0:
+                precedence = PRECEDENCE_SIGN
+                if ops and ops[-1][0] == "sign":
+                    precedence = ops[-1][2]
+                elif ops and ops[-1][0] == "op" and OPERATORS_DICT.get(ops[-1][1]) > 0:
+                    precedence = PRECEDENCE_SIGN_OPERAND
+                ops.append(("sign", text, precedence))
+            else:
+                raise ValueError(ERROR_SYNTAX + expr)
+        elif kind == "op":
+            reduce_stack(ops, nodes, OPERATORS_DICT.get(text), text == "^")
+            ops.append(("op", text))
+            expect_operand = True
+        elif kind == "close" or kind == "comma":
+            reduce_stack(ops, nodes, -1)
+            if not ops:
+                raise ValueError(ERROR_SYNTAX + expr)
+            _, bracket_open, func, n_nodes = ops[-1]
+            if kind == "comma":
+                if func is None:
+                    raise ValueError(ERROR_SYNTAX + expr)
+                expect_operand = True
+                continue
+            if text != BRACKETS.get(bracket_open):
+                raise ValueError(ERROR_SYNTAX + expr)
+            ops.pop()
+            if func is not None:
+                args = tuple(nodes[n_nodes:])
+                del nodes[n_nodes:]
+                nodes.append(Call(func, args))
+        else:
+            raise ValueError(ERROR_SYNTAX + expr)
+    if name is not None:
+        nodes.append(Symbol(name))
+        expect_operand = False
+    # an operand is missing at the end, e.g. x+
+    if expect_operand:
+        raise ValueError(ERROR_SYNTAX + expr)
+    reduce_stack(ops, nodes, -1)
+    if ops or len(nodes) != 1:
+        raise ValueError(ERROR_SYNTAX + expr)
+    return nodes[0]
+
+
+"""
+Gets the children of 'node'.
+
+@param node     node, node whose children are wanted
+
+@return         node tuple, children of 'node'
+"""
+def get_children(node):
+    if type(node) == Binary:
+        return (node.left, node.right)
+    if type(node) == Unary:
+        return (node.operand,)
+    if type(node) == Call:
+        return node.args
+    return ()
+
+
+"""
+Creates a node of the same kind as 'node' with the new children 'children'.
+
+@param node         node, node to be copied
+@param children     node list, new children in the order of 'get_children(..)'
+
+@return             node, node with the new children, 'node' itself 
+                    if the children have not changed
+"""
+def replace_children(node, children):
+    if type(node) == Binary:
+        return Binary(node.op, children[0], children[1])
+    if type(node) == Unary:
+        return Unary(node.op, children[0])
+    if type(node) == Call:
+        return Call(node.func, tuple(children))
+    return node
+
+
+"""
+Splits 'node' at its outer '+' and '-' operators and signs
+into its summands, in the order in which they are written.
+
+@param node         node, expression tree to be split
+@param is_negative  boolean, True if 'node' itself is subtracted
+
+@return             list of (boolean, node) tuples, the summands and 
+                    whether they are subtracted
+"""
+def split_summands(node, is_negative=False):
+    summands = []
+    stack = [(is_negative, node)]
+    while stack:
+        is_negative, node = stack.pop()
+        if type(node) == Binary and OPERATORS_DICT.get(node.op) == 0:
+            stack.append((is_negative != (node.op == "-"), node.right))
+            stack.append((is_negative, node.left))
+        elif type(node) == Unary:
+            stack.append((is_negative != (node.op == "-"), node.operand))
+        else:
+            summands.append((is_negative, node))
+    return summands
+
+
+"""
+Connects 'summands' through '+' and '-' operators.
+
+@param summands     list of (boolean, node) tuples, the summands and 
+                    whether they are subtracted, must not be empty
+
+@return             node, sum of the summands
+"""
+def join_summands(summands):
+    is_negative, node = summands[0]
+    if is_negative:
+        node = Unary("-", node)
+    for is_negative, summand in summands[1:]:
+        node = Binary("-" if is_negative else "+", node, summand)
+    return node
+
+
+"""
+Counts the distinct nodes of the expression tree 'node',
+i.e. the number of nodes of its DAG, every shared subtree
+is counted once.
+
+@param node     node, root of the expression tree
+
+@return         int, number of distinct nodes
+"""
+def count_nodes(node):
+    seen = {node}
+    stack = [node]
+    while stack:
+        for child in get_children(stack.pop()):
+            if child not in seen:
+                seen.add(child)
+                stack.append(child)
+    return len(seen)
+
+
+# structural hashes of the nodes that have been hashed,
+# see 'structural_hash(..)'
+HASHES = weakref.WeakKeyDictionary()
+
+# structural hashes are taken modulo 2^128
+HASH_MOD = 1 << 128
+
+
+"""
+Hashes 'parts' into a number that does not depend
+on the process, unlike the builtin 'hash(..)' of strings.
+
+@param parts    strings or numbers to be hashed
+
+@return         int, hash of the parts
+"""
+def hash_parts(*parts):
+    string = "|".join(str(part) for part in parts)
+    return int.from_bytes(hashlib.blake2b(string.encode("utf8"), digest_size=16).digest(), "big")
+
+
+"""
+Computes the hashes of 'node' from the hashes of its children.
+
+@param node     node, node to be hashed
+@param hashes   list of tuples, hashes of the children of 'node'
+                as returned by this method
+
+@return         tuple, (hash of 'node', sum of the hashes of the summands,
+                same sum with swapped signs, sum of the hashes of the factors)
+"""
+def hash_node(node, hashes):
+    if type(node) == Number:
+        node_hash = hash_parts("N", type(node.value).__name__, node.value)
+    elif type(node) == Symbol:
+        node_hash = hash_parts("S", node.name)
+    elif type(node) == Call:
+        node_hash = hash_parts("C", node.func, *(child[0] for child in hashes))
+    elif type(node) == Unary:
+        plus, minus = hashes[0][1:3]
+        if node.op == "-":
+            plus, minus = minus, plus
+        node_hash = hash_parts("+", plus)
+        return (node_hash, plus, minus, hash_parts("*", node_hash))
+    elif OPERATORS_DICT.get(node.op) == 0:
+        left, right = hashes
+        if node.op == "+":
+            plus, minus = left[1] + right[1], left[2] + right[2]
+        else:
+            plus, minus = left[1] + right[2], left[2] + right[1]
+        plus, minus = plus % HASH_MOD, minus % HASH_MOD
+        node_hash = hash_parts("+", plus)
+        return (node_hash, plus, minus, hash_parts("*", node_hash))
+    elif node.op == "*":
+        product = (hashes[0][3] + hashes[1][3]) % HASH_MOD
+        node_hash = hash_parts("*", product)
+        return (node_hash, hash_parts("+", "+", node_hash), hash_parts("+", "-", node_hash), product)
+    else:
+        node_hash = hash_parts("B", node.op, hashes[0][0], hashes[1][0])
+    return (node_hash, hash_parts("+", "+", node_hash), hash_parts("+", "-", node_hash), hash_parts("*", node_hash))
+
+
+"""
+Gets a structural hash of 'node' which is the same for all
+expressions that only differ in the order or the grouping of
+their summands or of their factors, e.g. for a+b and b+a or 
+for (a*b)*c and c*(b*a). The summands of a sum and the factors 
+of a product are combined by adding up their hashes, so no 
+sorting is needed. The hash does not depend on the process,
+so it can be used as a key that is stored. The hashes are 
+computed with an explicit stack and kept for every node.
+
+@param node     node, expression tree to be hashed
+
+@return         int, structural hash of 'node'
+"""
+def structural_hash(node):
+    hashes = HASHES.get(node)
+    if hashes is not None:
+        return hashes[0]
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in HASHES:
+            stack.pop()
+            continue
+        children = get_children(current)
+        children_todo = [child for child in children if child not in HASHES]
+        if children_todo:
+            stack.extend(children_todo)
+            continue
+        stack.pop()
+        HASHES[current] = hash_node(current, [HASHES.get(child) for child in children])
+    return HASHES.get(node)[0]
+
+
+"""
+Gets the nodes of 'node' such that every node comes
+after its children. Shared subtrees appear only once.
+
+@param node     node, root of the expression tree
+
+@return         list, nodes in post-order
+"""
+def get_nodes_in_order(node):
+    nodes = []
+    visited = set()
+    stack = [node]
+    while stack:
+        current = stack[-1]
+        if current in visited:
+            stack.pop()
+            continue
+        children_todo = [child for child in get_children(current) if child not in visited]
+        if children_todo:
+            stack.extend(children_todo)
+            continue
+        stack.pop()
+        visited.add(current)
+        nodes.append(current)
+    return nodes
+
+
+"""
+Checks if 'node' is a number with value 'value'.
+
+@param node     node, node to be checked
+@param value    int or float, value to compare with
+
+@return         boolean, True if 'node' is a number equal to 'value'
+"""
+def is_number(node, value):
+    return type(node) == Number and node.value == value
+
+
+"""
+Evaluates the precedence of 'node' as an operand of
+another node, e.g. 1 for a product, 0 for a unary sign.
+
+@param node     node, node whose precedence should be evaluated
+
+@return         int, precedence of 'node'
+"""
+def get_precedence(node):
+    if type(node) == Binary:
+        return OPERATORS_DICT.get(node.op)
+    if type(node) == Unary:
+        return 0
+    if type(node) == Number and node.value < 0:
+        return 0
+    return PRECEDENCE_ATOM
+
+
+"""
+Checks if the operand 'node' of an operator 'op' must be wrapped
+into brackets because of the precedence of the operators, 
+'^' is right associative.
+
+@param op       char, operator of the parent node
+@param node     node, operand to be checked
+@param is_left  boolean, True for the left operand of 'op'
+
+@return         boolean, True if brackets are necessary
+"""
+def needs_brackets(op, node, is_left):
+    precedence_op = OPERATORS_DICT.get(op)
+    precedence = get_precedence(node)
+    if precedence != precedence_op:
+        return precedence < precedence_op
+    if is_left:
+        return op == "^"
+    return op == "-"
+
+
+# markers for 'to_string(..)' to reserve a slot for an opening
+# bracket before an operand, and to fill it after the operand 
+# has been written if the operand starts with a sign
+SLOT_RESERVE = object()
+SLOT_FILL = object()
+
+
+"""
+Converts the expression tree 'node' into a string
+with as few brackets as possible. Every node is visited
+once and it is decided at that moment whether it needs 
+brackets. The tree is written with an explicit stack, 
+so deeply nested trees do not hit the recursion limit.
+
+@param node     node, root of the expression tree
+@param curly    boolean, True if arguments of functions
+                are enclosed by curly brackets, e.g. sin{x}
+
+@return         string, expression of 'node'
+"""
+@tracing.traced
+def to_string(node, curly=True):
+    bracket_open, bracket_closed = "{}" if curly else "()"
+    out = []
+    slots = []
+    # items are nodes, strings to write and slot markers,
+    # they are pushed in reverse order
+    stack = [node]
+    while stack:
+        item = stack.pop()
+        if type(item) == str:
+            out.append(item)
+        elif item is SLOT_RESERVE:
+            slots.append(len(out))
+            out.append("")
+        elif item is SLOT_FILL:
+            # an operand that is written with a leading sign
+            # needs brackets as well, e.g. a+(-b), which is only
+            # known after it has been written
+            pos = slots.pop()
+            if out[pos+1][0] in OPERATORS_DICT:
+                out[pos] = "("
+                out.append(")")
+        elif type(item) == Number:
+            out.append(str(item.value))
+        elif type(item) == Symbol:
+            out.append(item.name)
+        elif type(item) == Call:
+            stack.append(bracket_closed)
+            for i in range(len(item.args)-1, -1, -1):
+                stack.append(item.args[i])
+                if i > 0:
+                    stack.append(", ")
+            stack.append(item.func + bracket_open)
+        elif type(item) == Unary:
+            push_operand(stack, item.operand, get_precedence(item.operand) <= 0)
+            stack.append(item.op)
+        else:
+            if needs_brackets(item.op, item.right, False):
+                push_operand(stack, item.right, True)
+            else:
+                stack.append(SLOT_FILL)
+                stack.append(item.right)
+                stack.append(SLOT_RESERVE)
+            stack.append(item.op)
+            push_operand(stack, item.left, needs_brackets(item.op, item.left, True))
+    return "".join(out)
+
+
+"""
+Pushes 'node' as an operand to the stack of 'to_string(..)', 
+i.e. wrapped into brackets if 'is_wrapped' is True.
+"""
+def push_operand(stack, node, is_wrapped):
+    if is_wrapped:
+        stack.append(")")
+    stack.append(node)
+    if is_wrapped:
+        stack.append("(")
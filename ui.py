@@ -12,12 +12,16 @@ on the screen.
 *****************************************************
 """
 import sys
+import time
 
-import util
+import tree
+import context as ctx
 import brackets as br
 import derive as dev
 import simplify as sim
 import syntax as syn
+import tracing
+import registry
 
 from data import *
 
@@ -25,13 +29,16 @@ from data import *
 
 """
 Prints the instructions at the start of the program.
+
+@param context  Context, settings with the elementary functions,
+                None for the default
 """
-def print_instructions():
+def print_instructions(context=None):
     print(LINE_STARS)
     print("Use this programm to derive analytic expressions.")
     print("The argument to derive is " + ARG, end='')
     print(" and the following functions are being recognized:" + NEWLINE)
-    for elem_func in ELEM_FUNCTIONS:
+    for elem_func in ctx.get_context(context).functions:
         print(elem_func + "(" + ARG + ") ", end='')
     print(NEWLINE + NEWLINE + "Type 'quit' to exit the program.")
     print(LINE_STARS)
@@ -39,31 +46,109 @@ def print_instructions():
 
 
 
+# stages of the derivation as (name, debug label, method),
+# each method is applied to the result of the previous one
+# and the context of the derivation
+DERIVE_STAGES = [
+    ("parse", "Parsed:\t\t\t", lambda expr, context: tree.parse(expr)),
+    ("simplify", "Simplified:\t\t", lambda node, context: sim.simplify_tree(node, context=context)),
+    ("derive", "Derived:\t\t", lambda node, context: dev.derive_tree(node, context=context)),
+    ("remove_brackets", "Removed:\t\t", lambda node, context: br.remove_brackets_tree(node)),
+    ("simplify_derivative", "Simplified:\t\t", lambda node, context: sim.simplify_tree(node, context=context)),
+]
+
+
 """
 Computes the derivative of 'expr' and 
 performs the necessary transformations
-and simplifications.
+and simplifications. The expression is parsed
+only once, all steps work on the expression tree
+which is converted back to a string at the end.
+If the context has a persistent cache, derivatives
+of earlier runs are taken from there.
 
 @param expr     string, expression to be derived
+@param timings  dict, optional, filled with the seconds 
+                spent in each stage of 'DERIVE_STAGES'
+@param context  Context, settings of the derivation, None for the default
 
 @return         string, derivative of 'expr'
 """
-def derive_ui(expr):
-    expr = br.transform_brackets(expr)
-    util.debug_print("Transformed:\t\t" + expr, 1)
-    expr = sim.simplify(expr)
-    util.debug_print("Simplified:\t" + expr, 1)
-    expr = dev.derive_sub(expr)
-    util.debug_print("Derived:\t\t" + expr, 1)
-    expr = br.remove_brackets(expr)
-    util.debug_print("Removed:\t\t" + expr, 1)
-    expr = sim.simplify(expr)
-    util.debug_print("Simplified:\t\t" + expr, 1)
-    expr = br.back_transform_brackets(expr)
-    util.debug_print("Backtransformed:\t" + expr, 1)
+@tracing.traced
+def derive_ui(expr, timings=None, context=None):
+    context = ctx.get_context(context)
+    if timings is None:
+        timings = {}
+    node = expr
+    key = None
+    for name, label, stage in DERIVE_STAGES:
+        time_i = time.perf_counter()
+        node = stage(node, context)
+        timings[name] = time.perf_counter() - time_i
+        tracing.event("stage", "%s%s", label, node)
+        # the remaining stages are skipped if the parsed 
+        # expression has been derived in an earlier run
+        if name == "parse" and context.disk_cache is not None:
+            time_i = time.perf_counter()
+            key = context.get_disk_key(node)
+            derivative = context.disk_cache.get(key)
+            timings["disk_cache"] = time.perf_counter() - time_i
+            if derivative is not None:
+                tracing.event("stage", "Cached:\t\t\t%s", derivative)
+                return derivative
+    # round brackets for the output
+    time_i = time.perf_counter()
+    expr = tree.to_string(node, curly=False)
+    timings["to_string"] = time.perf_counter() - time_i
+    if key is not None:
+        context.disk_cache.put(key, expr)
     return expr
 
 
+"""
+Computes the partial derivatives of 'expr' for all variables 
+of 'args' like 'derive_ui(..)'. The stages before the derivation 
+are run once and the subtrees each variable depends on are only 
+found once, the later stages are run for every derivative.
+
+@param expr     string, expression to be derived
+@param args     iterable, names of the variables to derive for
+@param timings  dict, optional, filled with the seconds 
+                spent in each stage of 'DERIVE_STAGES'
+@param context  Context, settings of the derivation, None for the default
+@param reverse  boolean, True to derive all variables in one 
+                sweep in reverse mode, for many variables
+
+@return         dictionary, derivative of 'expr' for each variable
+"""
+@tracing.traced
+def gradient_ui(expr, args, timings=None, context=None, reverse=False):
+    context = ctx.get_context(context)
+    if timings is None:
+        timings = {}
+    node = expr
+    gradient = None
+    for name, label, stage in DERIVE_STAGES:
+        time_i = time.perf_counter()
+        if name == "derive":
+            gradient = dev.derive_gradient(node, args, context, reverse)
+        elif gradient is None:
+            node = stage(node, context)
+        else:
+            gradient = {arg : stage(gradient.get(arg), context) for arg in gradient}
+        timings[name] = time.perf_counter() - time_i
+        if gradient is None:
+            tracing.event("stage", "%s%s", label, node)
+        else:
+            for arg in gradient:
+                tracing.event("stage", "%s%s: %s", label, arg, gradient.get(arg))
+    # round brackets for the output
+    time_i = time.perf_counter()
+    gradient = {arg : tree.to_string(gradient.get(arg), curly=False) for arg in gradient}
+    timings["to_string"] = time.perf_counter() - time_i
+    return gradient
+
+
 """
 This must be done when exiting the program.
 """
@@ -73,14 +158,32 @@ def exit_ui(exit_code):
     
 
 """
-Main method. Prints the infinite loop.
+Prints the stages of the last derivation that were recorded 
+as events while tracing was on and removes the collected data.
+
+@param context  Context, context of the derivation
+"""
+def print_stages(context):
+    for event in tracing.get_report().get("events"):
+        if event.get("name") == "stage":
+            context.debug_print("%s", 1, event.get("message"))
+    tracing.reset()
+
+
+"""
+Main method. Prints the infinite loop. The expressions are
+derived with the functions of the registry and the stages of
+each derivation are printed if the debug level is at least 1.
 """
 def main():
-    print_instructions()
+    context = registry.get_context()
+    print_instructions(context)
+    if context.debug_level >= 1:
+        tracing.enable()
     while True:
         try:
             expr = input("Enter expression: \t")
-            util.debug_print("Expression:\t\t" + expr, 1)
+            context.debug_print("Expression:\t\t%s", 1, expr)
             if expr == "quit":
                 exit_ui(0)
             # apply replacements before syntax check
@@ -90,8 +193,10 @@ def main():
                 print(NEWLINE + ERROR_SYNTAX + NEWLINE + expr + NEWLINE)
                 continue
             expr = syn.modify_input(expr)
-            util.debug_print("Syntax mod:\t\t" + expr, 1)
-            print("Derivative:\t\t" + derive_ui(expr) + NEWLINE)
+            context.debug_print("Syntax mod:\t\t%s", 1, expr)
+            derivative = derive_ui(expr, context=context)
+            print_stages(context)
+            print("Derivative:\t\t" + derivative + NEWLINE)
         except KeyboardInterrupt:
             exit_ui(1)
         except Exception as e:
@@ -100,4 +205,5 @@ def main():
 
 
 # main method:
-main()
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,151 @@
 Utility methods that are used by the other files
 but that do not directly change the given expression.
 """
+import re
+import functools
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+import tracing
+
 from data import *
 
 
 
 """
-Prints 'string' when DEBUG_LEVEL is higher 
-than a required level.
+Prints 'string % args' when DEBUG_LEVEL is higher than a
+required level and records it as an event while tracing is on.
+The message is only formatted if it is printed or traced, 
+so large expressions can be passed in 'args' at no cost.
 
-@param string                   string, expression to print
+@param string                   string, expression or format string to print
 @param debug_level_required     int, required level for debug printout
+@param args                     arguments of the format string
 """
-def debug_print(string, debug_level_required):
-    if DEBUG_LEVEL  >= debug_level_required:
-        print(string)
+def debug_print(string, debug_level_required, *args):
+    tracing.event("debug", string, *args)
+    if DEBUG_LEVEL >= debug_level_required:
+        print(tracing.format_message(string, args))
+
+
+# marker for a key that is not in a cache,
+# since None can be a cached value as well
+CACHE_MISS = object()
+
+
+"""
+Cache with a maximum number of entries. If the cache is full,
+the least recently used entry is removed. Counts the hits 
+and misses of all lookups. All methods hold a lock, so a cache
+can be shared by several threads.
+"""
+class LRUCache(object):
+
+    """
+    @param maxsize  int, maximum number of entries, 0 disables the cache
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    """
+    @param key      key to look up
+    @param default  value to return if 'key' is not cached
+
+    @return         cached value of 'key', 'default' if there is none
+    """
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.entries.get(key, CACHE_MISS)
+            if value is CACHE_MISS:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    """
+    Caches 'value' for 'key' and removes the least 
+    recently used entries if the cache is full.
+
+    @param key      key of the entry
+    @param value    value of the entry
+    """
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.evict()
+
+    """
+    Changes the maximum number of entries.
+
+    @param maxsize  int, new maximum number of entries
+    """
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+    """
+    Removes the least recently used entries until
+    there are not more than 'maxsize' entries.
+    The lock must be held by the caller.
+    """
+    def evict(self):
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    """
+    Removes all entries and resets the counters.
+    """
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    """
+    @return         dictionary with the hits, misses, 
+                    maximum size and current size
+    """
+    def info(self):
+        with self.lock:
+            return {
+                "hits" : self.hits, 
+                "misses" : self.misses, 
+                "maxsize" : self.maxsize, 
+                "size" : len(self.entries)
+            }
+
+
+"""
+Builds a modified version of 'expr' in one pass. The edits 
+refer to positions of 'expr' itself, so they can be collected 
+before anything is changed.
+
+@param expr     string, expression to be modified
+@param edits    list of (pos, order, text, n_remove) tuples, 'text' is
+                inserted at 'pos' in place of the 'n_remove' characters 
+                from 'pos' on, edits at the same position are applied
+                in ascending 'order'
+
+@return         string, modified expression
+"""
+def apply_edits(expr, edits):
+    pieces = []
+    pos_last = 0
+    for pos, _, text, n_remove in sorted(edits):
+        pieces.append(expr[pos_last:pos])
+        pieces.append(text)
+        pos_last = pos + n_remove
+    pieces.append(expr[pos_last:])
+    return "".join(pieces)
 
 
 """
@@ -38,23 +169,314 @@ def parse_number(expr):
             return expr
 
 
+"""
+Compiles a regular expression that matches the variable 'arg'
+as a whole name, e.g. 'x' in 'x*y' but not in 'x1' or 'exp'.
+
+@param arg      string, name of the variable
+
+@return         compiled regular expression
+"""
+@functools.lru_cache(maxsize=None)
+def compile_arg_regex(arg):
+    return re.compile(r"(?<!\w)" + re.escape(arg) + r"(?!\w)")
+
+
+"""
+Compiles a regular expression that matches the names of all
+functions of 'funcs'. Longer names are tried first, so that 
+e.g. 'sinh' and not 'sin' is found, no matter in which 
+order the functions stand. 
+
+@param funcs    frozenset, names of the functions
+
+@return         compiled regular expression
+"""
+@functools.lru_cache(maxsize=None)
+def compile_elem_func_regex(funcs):
+    names = sorted(funcs, key=len, reverse=True)
+    # '(?!)' never matches, for the case of no functions at all
+    pattern = "|".join(re.escape(name) for name in names) or "(?!)"
+    return re.compile(pattern)
+
+
+"""
+Gets a compiled regular expression that matches the names of all
+elementary functions of 'funcs'. It is compiled once for each
+set of functions.
+
+@param funcs    iterable, names of the functions,
+                None for the functions of 'ELEM_FUNCTION_DEVS'
+
+@return         compiled regular expression
+"""
+def get_elem_func_regex(funcs=None):
+    if funcs is None:
+        funcs = ELEM_FUNCTION_DEVS
+    return compile_elem_func_regex(frozenset(funcs))
+
+
 """
 Detects if 'expr' contains an the first character of an
 elementary function at the position 'pos'.
 
 @param pos:     int, position where to look for the beginning of an elementary function
+@param funcs:   iterable, names of the functions, None for the functions of 'ELEM_FUNCTION_DEVS'
 
 @return:        string, elementary function that has been found, empty string if nothing could be found
 """
-def get_elem_func(expr, pos):
-    func_found = ""
+def get_elem_func(expr, pos, funcs=None):
+    match = get_elem_func_regex(funcs).match(expr, pos)
+    # a function must be followed by its argument
+    if match and match.end() < len(expr):
+        return match.group()
+    return ""
+
+
+"""
+Finds all elementary functions of 'expr' in one pass
+from left to right. Characters that belong to the name 
+of a function are not searched again, e.g. 'sinh' 
+does not contain 'sin'.
+
+@param expr     string, expression to be scanned
+@param funcs    iterable, names of the functions,
+                None for the functions of 'ELEM_FUNCTION_DEVS'
+
+@return         list of (int, string) tuples, positions
+                and names of the elementary functions
+"""
+def scan_elem_funcs(expr, funcs=None):
     n_expr = len(expr)
-    for func_elem in ELEM_FUNCTIONS:
-        n_func = len(func_elem)
-        if pos+n_func < n_expr:
-            if func_elem == expr[pos : pos+n_func]:
-                func_found = func_elem
-    return func_found
+    found = []
+    for match in get_elem_func_regex(funcs).finditer(expr):
+        # a function must be followed by its argument
+        if match.end() < n_expr:
+            found.append((match.start(), match.group()))
+    return found
+
+
+"""
+Index of the brackets and the operators of an expression
+which is built in one pass over the expression. It contains 
+the position of the matching bracket for each bracket and the
+positions of all operators grouped by their bracket depth, so
+that matching brackets and operators that are not enclosed
+by brackets can be looked up without scanning 'expr' again.
+The positions per character are kept in compact arrays.
+"""
+class BracketIndex(object):
+
+    """
+    @param expr     string, expression to be indexed
+    """
+    def __init__(self, expr):
+        self.expr = expr
+        # position of the matching bracket for each bracket, -1 otherwise
+        self.match = array("l", [-1])*len(expr)
+        # bracket depth before each position
+        self.depth = array("l", [0])*len(expr)
+        # sorted positions of the operators for each (operator, depth)
+        self.ops = {}
+        # depths at which an operator occurs
+        self.op_depths = {}
+        # position of the innermost open bracket 
+        # enclosing each position, -1 otherwise
+        self.enclosing = array("l", [-1])*len(expr)
+        # True if every bracket has a matching bracket
+        self.is_balanced = True
+        # bracket count for each bracket type
+        self.bracket_counts = dict.fromkeys(BRACKETS, 0)
+        brackets_closed = {BRACKETS.get(bracket) : bracket for bracket in BRACKETS}
+        stacks = {bracket : [] for bracket in BRACKETS}
+        # open brackets of all types
+        opened = []
+        depth = 0
+        for i, ch in enumerate(expr):
+            self.depth[i] = depth
+            if opened:
+                self.enclosing[i] = opened[-1]
+            if ch in BRACKETS:
+                stacks.get(ch).append(i)
+                opened.append(i)
+                self.bracket_counts[ch] += 1
+                depth += 1
+            elif ch in brackets_closed:
+                bracket_open = brackets_closed.get(ch)
+                stack = stacks.get(bracket_open)
+                if stack:
+                    j = stack.pop()
+                    self.match[i] = j
+                    self.match[j] = i
+                    if opened and opened[-1] == j:
+                        opened.pop()
+                else:
+                    self.is_balanced = False
+                self.bracket_counts[bracket_open] -= 1
+                depth -= 1
+            elif not ch.isalnum():
+                positions = self.ops.get((ch, depth))
+                if positions is None:
+                    positions = []
+                    self.ops[(ch, depth)] = positions
+                    self.op_depths.setdefault(ch, []).append(depth)
+                positions.append(i)
+        if opened:
+            self.is_balanced = False
+
+    """
+    Finds the closing bracket if there is an opening bracket at 'pos'.
+
+    @param pos      int, position of opening bracket
+
+    @return         int, position of closing bracket
+                    -2 if there was no opening bracket at 'pos'
+                    -1 if no closing bracket could be found
+    """
+    def get_closed_bracket_pos(self, pos):
+        if self.expr[pos] not in BRACKETS:
+            return -2
+        return self.match[pos]
+
+    """
+    Gets the end of the innermost brackets that enclose 'pos'.
+
+    @param pos      int, position in the expression
+
+    @return         int, position of the closing bracket,
+                    length of the expression if 'pos' is not enclosed
+    """
+    def get_enclosing_end(self, pos):
+        pos_open = self.enclosing[pos]
+        if pos_open == -1 or self.match[pos_open] == -1:
+            return len(self.expr)
+        return self.match[pos_open]
+
+    """
+    Gets the parts of the span from 'start' to 'end' whose operators
+    'op' are not enclosed by brackets. Usually the span does not leave
+    the brackets around 'start', then these are only the operators
+    at the depth of 'start'. Otherwise each closing bracket of the
+    span starts a part one depth lower.
+
+    @param op       char, operator to look for
+    @param start    int, start of the span
+    @param end      int, end of the span (exclusive)
+
+    @return         generator, (depth, start) of each part 
+                    in the order of the positions
+    """
+    def iter_span_levels(self, op, start, end):
+        if not self.is_balanced:
+            depth_start = self.depth[start]
+            for depth in self.op_depths.get(op, []):
+                if depth <= depth_start:
+                    yield depth, start
+            return
+        while start < end:
+            yield self.depth[start], start
+            start = self.get_enclosing_end(start) + 1
+
+    """
+    Gets the position of the first occurance of an operator 'op' 
+    within the span from 'start' to 'end' that is NOT enclosed 
+    by brackets which are opened within that span.
+
+    @param op       char, operator to look for
+    @param start    int, start of the span
+    @param end      int, end of the span (exclusive), 
+                    None for the end of the expression
+
+    @return         int, first occurance of 'op' in the span
+                    -1 if the 'op' did not occur in the span
+                    or if it is enclosed by brackets
+    """
+    def get_pos_of_first_op(self, op, start=0, end=None):
+        if end is None:
+            end = len(self.expr)
+        if start >= end:
+            return -1
+        pos = -1
+        for depth, start_level in self.iter_span_levels(op, start, end):
+            # later parts only have later operators
+            if pos != -1 and pos < start_level:
+                break
+            positions = self.ops.get((op, depth), [])
+            i = bisect_left(positions, start_level)
+            if i < len(positions) and positions[i] < end:
+                if pos == -1 or positions[i] < pos:
+                    pos = positions[i]
+        return pos
+
+    """
+    Gets the operators with the lowest precedence within the span
+    from 'start' to 'end' that are NOT enclosed by brackets, 
+    e.g. both '+' and '-' of a*b+c-d. All operators are looked up 
+    together in the index instead of one search per operator.
+
+    @param start        int, start of the span
+    @param end          int, end of the span (exclusive), 
+                        None for the end of the expression
+    @param operators    dictionary, operators and their precedence
+
+    @return             int list, sorted positions of the operators, 
+                        empty if there is no operator in the span
+    """
+    def get_pos_of_lowest_precedence_ops(self, start=0, end=None, operators=OPERATORS_DICT):
+        if end is None:
+            end = len(self.expr)
+        if start >= end:
+            return []
+        precedence_lowest = None
+        positions = []
+        for op in operators:
+            precedence = operators.get(op)
+            if precedence_lowest is not None and precedence > precedence_lowest:
+                continue
+            positions_op = []
+            for depth, start_level in self.iter_span_levels(op, start, end):
+                positions_depth = self.ops.get((op, depth), [])
+                positions_op += positions_depth[bisect_left(positions_depth, start_level):bisect_left(positions_depth, end)]
+            if not positions_op:
+                continue
+            if precedence_lowest is None or precedence < precedence_lowest:
+                precedence_lowest = precedence
+                positions = positions_op
+            else:
+                positions += positions_op
+        return sorted(positions)
+
+    """
+    Gets the positions of all operators 'op' within the span
+    from 'start' to 'end' that are NOT enclosed by brackets.
+
+    @param op       char, operator to look for
+    @param start    int, start of the span
+    @param end      int, end of the span (exclusive), 
+                    None for the end of the expression
+
+    @return         int list, list of operator positions
+    """
+    def get_pos_of_all_ops(self, op, start=0, end=None):
+        positions = []
+        pos = self.get_pos_of_first_op(op, start, end)
+        while pos > -1:
+            positions.append(pos)
+            pos = self.get_pos_of_first_op(op, pos+1, end)
+        return positions
+
+
+"""
+Gets the bracket index of 'expr'. The index is built 
+only once per expression and is then taken from a cache.
+
+@param expr     string, expression to be indexed
+
+@return         BracketIndex, index of 'expr'
+"""
+@functools.lru_cache(maxsize=BRACKET_INDEX_CACHE_SIZE)
+def get_bracket_index(expr):
+    return BracketIndex(expr)
 
 
 """
@@ -69,19 +491,7 @@ of an expression 'expr'
                 -1 if no closing bracket could be found
 """
 def get_closed_bracket_pos(expr, pos):
-    countOpen = 0;
-    bracket_open = expr[pos]
-    bracket_closed = BRACKETS.get(bracket_open)
-    if bracket_closed == "":
-        return -2
-    for i, ch in enumerate(expr[pos+1:], start=pos+1):
-        if ch == bracket_open:
-            countOpen += 1
-        elif ch == bracket_closed:
-            countOpen -= 1
-        if countOpen == -1:
-            return i
-    return -1
+    return get_bracket_index(expr).get_closed_bracket_pos(pos)
 
 
 """
@@ -90,30 +500,16 @@ within an expression 'expr' that is NOT enclosed by brackets.
 
 @param expr     string, expression to be analyzed
 @param op       char, operator to look for
+@param start    int, position in 'expr' where to start looking
+@param end      int, position in 'expr' where to stop looking (exclusive),
+                None for the end of 'expr'
 
 @return         int, first occurance of 'op' in 'expr'
                 -1 if the 'op' did not occur in 'expr' 
                 or if it is enclosed by bracket
 """
-def get_pos_of_first_op(expr, op):
-    n_expr = len(expr)
-    # bracket count for each bracket type
-    bc = [0]*N_BRAC
-    for i, ch in enumerate(expr):
-        for j, bracket in enumerate(BRACKETS):
-            if ch == bracket:
-                bc[j] += 1
-            elif ch == BRACKETS.get(bracket):
-                bc[j] -= 1
-        if ch == op:
-            op_is_not_inside_brackets = True
-            for j, _ in enumerate(BRACKETS):
-                if bc[j] > 0:
-                    op_is_not_inside_brackets = False
-                    break
-            if op_is_not_inside_brackets:
-                return i
-    return -1
+def get_pos_of_first_op(expr, op, start=0, end=None):
+    return get_bracket_index(expr).get_pos_of_first_op(op, start, end)
 
 
 """
@@ -122,21 +518,32 @@ within an expression 'expr' that are NOT enclosed by brackets.
 
 @param expr     string, expression to be analyzed
 @param op       char, operator to look for
+@param start    int, position in 'expr' where to start looking
+@param end      int, position in 'expr' where to stop looking (exclusive),
+                None for the end of 'expr'
 
 @return         int list, list of operator positions
 """
-def get_pos_of_all_ops(expr, op):
-    n_expr = len(expr)
-    i = 0
-    positions = []
-    while (i<n_expr):
-        pos = get_pos_of_first_op(expr[i:], op)
-        if pos == -1:
-            break
-        positions.append(i+pos)
-        i += pos + 1
-    
-    return positions
+def get_pos_of_all_ops(expr, op, start=0, end=None):
+    return get_bracket_index(expr).get_pos_of_all_ops(op, start, end)
+
+
+"""
+Gets the positions of all 'outer' operators of 'expr'
+with the lowest precedence in one lookup,
+e.g. a*b+c*d-e returns 3 and 7, the positions of '+' and '-'.
+
+@param expr         string, expression to be searched
+@param start        int, position in 'expr' where to start looking
+@param end          int, position in 'expr' where to stop looking (exclusive),
+                    None for the end of 'expr'
+@param operators    dictionary, operators and their precedence
+
+@return             int list, sorted positions of the found operators,
+                    empty when no operator has been found
+"""
+def get_pos_of_lowest_precedence_ops(expr, start=0, end=None, operators=OPERATORS_DICT):
+    return get_bracket_index(expr).get_pos_of_lowest_precedence_ops(start, end, operators)
 
 
 """
@@ -144,26 +551,17 @@ Finds the position of the first 'outer' operator of 'expr',
 starting with the operator with lowest precedence ('+')
 e.g. a*b+c*d returns 3, the position of '+'.
 
-@param expr     string, expression to be searched
-
-@return         int, position of the found operator,
-                -1 when no operator has been found
-"""
-def get_pos_of_first_lowest_precedence_op(expr):
-    pos = -1
-    precedence_last = 10
-    precedence_now = 10
-    positions = []
-    for op in OPERATORS_DICT:
-        pos = get_pos_of_first_op(expr, op)
-        if pos == -1:
-            continue
-        precedence_last = precedence_now 
-        precedence_now = OPERATORS_DICT.get(op) 
-        if precedence_now > precedence_last:
-            break
-        positions.append(pos)
+@param expr         string, expression to be searched
+@param start        int, position in 'expr' where to start looking
+@param end          int, position in 'expr' where to stop looking (exclusive),
+                    None for the end of 'expr'
+@param operators    dictionary, operators and their precedence
+
+@return             int, position of the found operator,
+                    -1 when no operator has been found
+"""
+def get_pos_of_first_lowest_precedence_op(expr, start=0, end=None, operators=OPERATORS_DICT):
+    positions = get_pos_of_lowest_precedence_ops(expr, start, end, operators)
     if positions:
-        return min(positions)        
+        return positions[0]
     return -1
-